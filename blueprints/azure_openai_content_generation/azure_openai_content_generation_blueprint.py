@@ -1,9 +1,76 @@
-import os
-import openai
+import asyncio
 import json
+import os
+import re
 import azure.functions as func
+import openai
 from azure.functions import Blueprint
 from generated_models.models import AzureOpenAIGenerateContentRequest, AzureOpenAIGenerateContentResponse
+from pydantic import ValidationError
+from shared.errors import StageError
+from shared.logger import structured_logger
+from shared.tracing import span
+from shared.utils.llm_response_cache import (
+    get_cached_response,
+    get_persistent_backend,
+    response_cache_enabled,
+    response_cache_key,
+    response_cache_ttl,
+    store_response,
+)
+from shared.utils.deployment_pool import get_deployment_pool
+from shared.utils.openai_utils import get_openai_settings
+from shared.utils.prompt_template import compile_prompt, select_variable_value_sets
+from shared.utils.stream_utils import JsonFieldStreamer
+
+# Prepended to the per-variant briefs of a multi-variant request
+VARIANTS_INSTRUCTION = (
+    "Write {count} independent variants, one for each brief below, each following the instructions above. "
+    'Respond with only a JSON object of the form {{"variants": [{{"text": "...", "comment": "...", "hashtags": ["..."]}}]}} '
+    "listing the variants in brief order."
+)
+
+# JSON schema of AzureOpenAIGenerateContentResponse, in the strict form structured outputs require
+CONTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "comment": {"type": "string"},
+        "hashtags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["text", "comment", "hashtags"],
+    "additionalProperties": False,
+}
+VARIANTS_SCHEMA = {
+    "type": "object",
+    "properties": {"variants": {"type": "array", "items": CONTENT_SCHEMA}},
+    "required": ["variants"],
+    "additionalProperties": False,
+}
+
+# System prompt of a repair call: only the invalid output and its errors are sent, not the original prompt
+REPAIR_INSTRUCTION = (
+    "The JSON below was generated for a social media post but does not match the required schema. "
+    "Fix only the listed problems, keep the wording of the existing fields unchanged and respond with only the corrected JSON.\n"
+    "Schema: {schema}"
+)
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+# Deployments that rejected a json_schema response_format (older models or api versions);
+# their requests are sent without one and rely on validation and repair instead
+_structured_output_unsupported = set()
+
+
+class InvalidContentError(ValueError):
+    """A choice whose output does not validate against `schema`; `index` is the choice it came from."""
+
+    def __init__(self, raw: str, error: str, schema: dict):
+        super().__init__(error)
+        self.raw = raw
+        self.error = error
+        self.schema = schema
+        self.index = 0
 
 text_generation_blueprint = Blueprint()
 
@@ -12,56 +79,415 @@ def generate_text_content(req: func.HttpRequest) -> func.HttpResponse:
     try:
         data = req.get_json()
         text_content_request = AzureOpenAIGenerateContentRequest(**data)
+        variant_count = get_variant_count(data)
+        if variant_count > 1:
+            template = text_content_request.template
+            variable_value_sets = None
+            if data.get("randomizeVariables"):
+                variable_value_sets = select_variable_value_sets(
+                    template["settings"]["prompt_template"], text_content_request.variableValues or {}, variant_count
+                )
+            variants = generate_text_variants_logic(
+                template, text_content_request.variableValues or {}, variant_count, variable_value_sets
+            )
+            body = {"variants": [AzureOpenAIGenerateContentResponse(**variant).model_dump() for variant in variants]}
+            return func.HttpResponse(json.dumps(body), status_code=200, mimetype="application/json")
         content = generate_text_content_logic(text_content_request.template, text_content_request.variableValues or {})
         from generated_models.models import AzureOpenAIGenerateContentResponse
         response_model = AzureOpenAIGenerateContentResponse(**content)
         return func.HttpResponse(response_model.model_dump_json(), status_code=200, mimetype="application/json")
+    except StageError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=e.status_code, mimetype="application/json")
+    except ValueError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=400, mimetype="application/json")
     except Exception as e:
         return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
 
-def generate_text_content_logic(template: dict, variable_values: dict) -> dict:
+def get_variant_count(data: dict) -> int:
     """
-    Calls Azure OpenAI to generate content based on the template and variable values.
-    Returns a dict with keys: text, comment, hashtags.
+    The request's variantCount (default 1), capped by TEXT_GENERATION_MAX_VARIANTS (default 10).
+    Raises ValueError for a count outside that range.
     """
-    endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
-    api_key = os.environ.get("AZURE_OPENAI_API_KEY")
-    api_version = os.environ.get("AZURE_OPENAI_API_VERSION")
-    deployment = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME")
+    variant_count = int(data.get("variantCount") or 1)
+    max_variants = int(os.environ.get("TEXT_GENERATION_MAX_VARIANTS", "10"))
+    if not 1 <= variant_count <= max_variants:
+        raise ValueError(f"variantCount must be between 1 and {max_variants}.")
+    return variant_count
 
+def build_chat_request(template: dict, variable_values: dict, deployment: str) -> dict:
+    """
+    Renders the template's prompts with variable values, logging placeholders
+    left without a value and values no placeholder uses.
+    Returns the keyword arguments for chat.completions.create.
+    """
     prompt_template = template["settings"]["prompt_template"]
-    system_prompt = prompt_template["system_prompt"]
-    user_prompt = prompt_template["user_prompt"]
+    system_template = compile_prompt(prompt_template["system_prompt"])
+    user_template = compile_prompt(prompt_template["user_prompt"])
     model = prompt_template["model"]
     temperature = prompt_template.get("temperature", 1)
     max_tokens = prompt_template.get("max_tokens", 512)
 
-    # Render user/system prompt with variable values
-    for k, v in variable_values.items():
-        user_prompt = user_prompt.replace(f"{{{{{k}}}}}", str(v))
-        system_prompt = system_prompt.replace(f"{{{{{k}}}}}", str(v))
+    # Render user/system prompt with variable values (compiled once per prompt text)
+    system_prompt = system_template.render(variable_values)
+    user_prompt = user_template.render(variable_values)
+    missing = system_template.missing(variable_values) + user_template.missing(variable_values)
+    extra = [name for name in user_template.extra(variable_values) if name not in system_template.variables]
+    if missing or extra:
+        structured_logger.warning("Prompt variables mismatch", missing=sorted(set(missing)), extra=extra)
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
+    chat_request = {
+        "model": deployment,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if structured_output_enabled(prompt_template):
+        chat_request["response_format"] = json_schema_response_format("post_content", CONTENT_SCHEMA)
+    return chat_request
+
+def structured_output_enabled(prompt_template: dict) -> bool:
+    """
+    Schema-constrained JSON output is on unless the template sets prompt_template.structured_output to false.
+    Deployments that reject it are retried without it (see _pool_complete).
+    """
+    return prompt_template.get("structured_output", True) is not False
+
+def json_schema_response_format(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
 
-    # Use OpenAI v1+ Azure client
-    client = openai.AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        azure_endpoint=endpoint
+def _response_format_rejected(error) -> bool:
+    """Whether a 400 is the deployment or api version not supporting the request's response_format."""
+    if not isinstance(error, openai.BadRequestError):
+        return False
+    message = str(error).lower()
+    return getattr(error, "param", None) == "response_format" or "response_format" in message or "json_schema" in message
+
+def _without_response_format(chat_request: dict) -> dict:
+    return {key: value for key, value in chat_request.items() if key != "response_format"}
+
+def _structured_request(chat_request: dict) -> dict:
+    """`chat_request`, minus its response_format if the deployment is known not to support one."""
+    if "response_format" in chat_request and chat_request["model"] in _structured_output_unsupported:
+        return _without_response_format(chat_request)
+    return chat_request
+
+def _structured_output_fallback(chat_request: dict, error) -> dict:
+    """Remembers that the deployment rejected structured output and returns the request to retry without it."""
+    _structured_output_unsupported.add(chat_request["model"])
+    structured_logger.warning(
+        "Structured output not supported; retrying without response_format", deployment=chat_request["model"], error=str(error)
     )
+    return _without_response_format(chat_request)
+
+def _pool_complete(chat_request: dict):
+    """
+    Runs `chat_request` on the deployment pool. A json_schema response_format the deployment
+    rejects with 400 is dropped and the call retried once without it.
+    """
+    chat_request = _structured_request(chat_request)
+    try:
+        return get_deployment_pool().complete(chat_request)
+    except openai.BadRequestError as e:
+        if "response_format" not in chat_request or not _response_format_rejected(e):
+            raise
+        return get_deployment_pool().complete(_structured_output_fallback(chat_request, e))
+
+async def _pool_complete_async(chat_request: dict):
+    """Async variant of _pool_complete."""
+    chat_request = _structured_request(chat_request)
+    try:
+        return await get_deployment_pool().complete_async(chat_request)
+    except openai.BadRequestError as e:
+        if "response_format" not in chat_request or not _response_format_rejected(e):
+            raise
+        return await get_deployment_pool().complete_async(_structured_output_fallback(chat_request, e))
+
+def _load_json(content_json: str):
+    """json.loads that tolerates a Markdown code fence or prose around the object."""
+    text = _CODE_FENCE.sub("", content_json.strip())
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
 
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens
+def validate_content(content) -> dict:
+    """
+    Validates one {text, comment, hashtags} object with AzureOpenAIGenerateContentResponse,
+    after coercing the slips that need no model call (null comment, hashtags as one string).
+    Raises pydantic.ValidationError.
+    """
+    if isinstance(content, dict):
+        content = dict(content)
+        if content.get("comment") is None:
+            content["comment"] = ""
+        if isinstance(content.get("hashtags"), str):
+            content["hashtags"] = [tag for tag in re.split(r"[\s,]+", content["hashtags"]) if tag]
+    return AzureOpenAIGenerateContentResponse.model_validate(content).model_dump(mode="json")
+
+def parse_content_response(content_json: str) -> dict:
+    """Parses and validates one response; raises InvalidContentError when it does not match CONTENT_SCHEMA."""
+    try:
+        return validate_content(_load_json(content_json or ""))
+    except (json.JSONDecodeError, ValidationError) as e:
+        raise InvalidContentError(content_json or "", str(e), CONTENT_SCHEMA) from e
+
+def get_response_cache_key(template: dict, chat_request: dict):
+    """Response cache key for the request, or None when the template has not opted in to response caching."""
+    if not response_cache_enabled(template["settings"]["prompt_template"]):
+        return None
+    return response_cache_key(chat_request)
+
+def build_variants_chat_request(template: dict, variable_value_sets: list, deployment: str) -> dict:
+    """
+    Builds one chat request asking for a variant per variable combination: the
+    user prompt is rendered once per combination and the model answers with a
+    {"variants": [...]} array in the same order.
+    """
+    chat_request = build_chat_request(template, variable_value_sets[0], deployment)
+    user_template = compile_prompt(template["settings"]["prompt_template"]["user_prompt"])
+    briefs = user_template.render_many(variable_value_sets)
+    chat_request["messages"][1]["content"] = VARIANTS_INSTRUCTION.format(count=len(briefs)) + "\n\n" + "\n\n".join(
+        f"Brief {index}:\n{brief}" for index, brief in enumerate(briefs, 1)
     )
-    content_json = response.choices[0].message.content
+    chat_request["max_tokens"] = chat_request["max_tokens"] * len(briefs)
+    if "response_format" in chat_request:
+        chat_request["response_format"] = json_schema_response_format("post_variants", VARIANTS_SCHEMA)
+    return chat_request
+
+def parse_variants_response(content_json: str, count: int = None) -> list:
+    """
+    Parses and validates a {"variants": [...]} (or bare array) response of `count` variants;
+    raises InvalidContentError when it does not match VARIANTS_SCHEMA.
+    """
     try:
-        content = json.loads(content_json)
-    except Exception:
-        content = {"text": content_json, "comment": "", "hashtags": []}
+        parsed = _load_json(content_json or "")
+        variants = parsed.get("variants") if isinstance(parsed, dict) else parsed
+        if not isinstance(variants, list):
+            raise ValueError('Expected a "variants" array.')
+        if count is not None and len(variants) != count:
+            raise ValueError(f"Expected {count} variants, got {len(variants)}.")
+        return [validate_content(variant) for variant in variants]
+    except (ValueError, ValidationError) as e:  # JSONDecodeError is a ValueError
+        raise InvalidContentError(content_json or "", str(e), VARIANTS_SCHEMA) from e
+
+def _choice_content(choice) -> str:
+    if choice.message.content is None and getattr(choice.message, "refusal", None):
+        raise StageError(f"Azure OpenAI refused the request: {choice.message.refusal}", 422)
+    return choice.message.content
+
+def _parse_choices(contents: list, parse_one) -> list:
+    """Applies `parse_one` to every choice, tagging an InvalidContentError with the failing choice's index."""
+    results = []
+    for index, content in enumerate(contents):
+        try:
+            results.append(parse_one(content))
+        except InvalidContentError as e:
+            e.index = index
+            raise
+    return results
+
+def prepare_variants_request(template: dict, variable_values: dict, variants: int, variable_value_sets, deployment: str):
+    """
+    Returns (chat_request, parse) for `variants` results from a single call: a
+    structured array over `variable_value_sets` when they are given, otherwise
+    the API's `n` parameter (sampled completions of one prompt).
+    """
+    if variable_value_sets and len(variable_value_sets) > 1:
+        count = len(variable_value_sets)
+        return build_variants_chat_request(template, variable_value_sets, deployment), (
+            lambda contents: parse_variants_response(contents[0], count)
+        )
+    chat_request = build_chat_request(template, variable_values, deployment)
+    chat_request["n"] = variants
+    return chat_request, lambda contents: _parse_choices(contents, parse_content_response)
+
+def _max_repairs() -> int:
+    return int(os.environ.get("TEXT_GENERATION_MAX_REPAIRS", "2"))
+
+def build_repair_request(chat_request: dict, error: InvalidContentError) -> dict:
+    """
+    A chat request that asks the model to correct `error.raw` against `error.schema`.
+    It carries only the invalid output and the validation errors, so it costs a
+    fraction of a full regeneration and keeps the copy already written.
+    """
+    repair_request = {
+        "model": chat_request["model"],
+        "messages": [
+            {"role": "system", "content": REPAIR_INSTRUCTION.format(schema=json.dumps(error.schema))},
+            {"role": "user", "content": f"Problems:\n{error.error}\n\nJSON:\n{error.raw}"},
+        ],
+        "temperature": 0,
+        "max_tokens": chat_request["max_tokens"],
+    }
+    if "response_format" in chat_request:
+        name = "post_variants" if error.schema is VARIANTS_SCHEMA else "post_content"
+        repair_request["response_format"] = json_schema_response_format(name, error.schema)
+    return repair_request
+
+def _repair_exhausted(error: InvalidContentError):
+    structured_logger.error("Generated content failed validation after repair", error=error.error)
+    return StageError(f"Azure OpenAI returned content that does not match the response schema: {error.error}", 502)
+
+def _parse_with_repair(chat_request: dict, contents: list, parse):
+    """
+    Returns `parse(contents)` for the choices' output, repairing each invalid choice in place with a
+    targeted repair call; at most TEXT_GENERATION_MAX_REPAIRS (default 2) repair
+    calls are made per generation before StageError(502) is raised.
+    """
+    max_repairs = _max_repairs()
+    for repairs in range(max_repairs + 1):
+        try:
+            return parse(contents)
+        except InvalidContentError as e:
+            if repairs >= max_repairs:
+                raise _repair_exhausted(e) from e
+            structured_logger.warning("Repairing generated content", error=e.error, choice=e.index)
+            with span("openai.repair", deployment=chat_request["model"], choice=e.index):
+                repaired = _pool_complete(build_repair_request(chat_request, e))
+            contents[e.index] = _choice_content(repaired.choices[0])
+
+async def _parse_with_repair_async(chat_request: dict, contents: list, parse):
+    """Async variant of _parse_with_repair."""
+    max_repairs = _max_repairs()
+    for repairs in range(max_repairs + 1):
+        try:
+            return parse(contents)
+        except InvalidContentError as e:
+            if repairs >= max_repairs:
+                raise _repair_exhausted(e) from e
+            structured_logger.warning("Repairing generated content", error=e.error, choice=e.index)
+            with span("openai.repair", deployment=chat_request["model"], choice=e.index):
+                repaired = await _pool_complete_async(build_repair_request(chat_request, e))
+            contents[e.index] = _choice_content(repaired.choices[0])
+
+def _complete(template: dict, chat_request: dict, parse):
+    """
+    Runs `chat_request` on the pooled client and returns `parse` of the choices' output, repaired when invalid.
+    Templates with prompt_template.response_cache set are answered from the response cache when the request repeats.
+    """
+    cache_key = get_response_cache_key(template, chat_request)
+    if cache_key:
+        with span("openai.response_cache") as attributes:
+            cached = get_cached_response(cache_key)
+            attributes["hit"] = cached is not None
+        if cached is not None:
+            return cached
+
+    # Routed across the deployment pool on pooled, rate-limited clients
+    with span("openai.chat_completion", deployment=chat_request["model"], n=chat_request.get("n", 1)) as attributes:
+        response = _pool_complete(chat_request)
+        attributes["total_tokens"] = getattr(response.usage, "total_tokens", None)
+    contents = [_choice_content(choice) for choice in response.choices]
+    content = _parse_with_repair(chat_request, contents, parse)
+    if cache_key:
+        store_response(cache_key, content, response_cache_ttl(template["settings"]["prompt_template"]))
     return content
+
+async def _complete_async(template: dict, chat_request: dict, parse):
+    """Async variant of _complete built on openai.AsyncAzureOpenAI."""
+    cache_key = get_response_cache_key(template, chat_request)
+    # A persistent backend does blocking I/O, so it is consulted off the event loop
+    offload = get_persistent_backend() is not None
+    if cache_key:
+        with span("openai.response_cache") as attributes:
+            cached = await asyncio.to_thread(get_cached_response, cache_key) if offload else get_cached_response(cache_key)
+            attributes["hit"] = cached is not None
+        if cached is not None:
+            return cached
+
+    with span("openai.chat_completion", deployment=chat_request["model"], n=chat_request.get("n", 1)) as attributes:
+        response = await _pool_complete_async(chat_request)
+        attributes["total_tokens"] = getattr(response.usage, "total_tokens", None)
+    contents = [_choice_content(choice) for choice in response.choices]
+    content = await _parse_with_repair_async(chat_request, contents, parse)
+    if cache_key:
+        ttl = response_cache_ttl(template["settings"]["prompt_template"])
+        if offload:
+            await asyncio.to_thread(store_response, cache_key, content, ttl)
+        else:
+            store_response(cache_key, content, ttl)
+    return content
+
+def _parse_first_choice(contents: list) -> dict:
+    return parse_content_response(contents[0])
+
+def generate_text_content_logic(template: dict, variable_values: dict) -> dict:
+    """
+    Calls Azure OpenAI to generate content based on the template and variable values.
+    Returns a dict with keys: text, comment, hashtags.
+    """
+    settings = get_openai_settings()
+    chat_request = build_chat_request(template, variable_values, settings["deployment"])
+    return _complete(template, chat_request, _parse_first_choice)
+
+async def generate_text_content_logic_async(template: dict, variable_values: dict) -> dict:
+    """
+    Async variant of generate_text_content_logic built on openai.AsyncAzureOpenAI.
+    Returns a dict with keys: text, comment, hashtags.
+    """
+    settings = get_openai_settings()
+    chat_request = build_chat_request(template, variable_values, settings["deployment"])
+    return await _complete_async(template, chat_request, _parse_first_choice)
+
+def generate_text_variants_logic(template: dict, variable_values: dict, variants: int, variable_value_sets=None) -> list:
+    """
+    Generates `variants` results in a single Azure OpenAI call (see prepare_variants_request).
+    Returns a list of dicts with keys: text, comment, hashtags.
+    """
+    settings = get_openai_settings()
+    chat_request, parse = prepare_variants_request(template, variable_values, variants, variable_value_sets, settings["deployment"])
+    return _complete(template, chat_request, parse)
+
+async def generate_text_variants_logic_async(template: dict, variable_values: dict, variants: int, variable_value_sets=None) -> list:
+    """Async variant of generate_text_variants_logic."""
+    settings = get_openai_settings()
+    chat_request, parse = prepare_variants_request(template, variable_values, variants, variable_value_sets, settings["deployment"])
+    return await _complete_async(template, chat_request, parse)
+
+async def stream_text_content_logic_async(template: dict, variable_values: dict):
+    """
+    Streams a generation: yields ("delta", {"content", "text"}) for every chunk the
+    model sends, where `content` is the raw token text and `text` the newly decoded
+    part of the "text" field, then ("result", {text, comment, hashtags}) parsed
+    from the complete output. A cached response is replayed as one delta.
+    """
+    settings = get_openai_settings()
+    chat_request = build_chat_request(template, variable_values, settings["deployment"])
+    cache_key = get_response_cache_key(template, chat_request)
+    offload = get_persistent_backend() is not None
+    if cache_key:
+        cached = await asyncio.to_thread(get_cached_response, cache_key) if offload else get_cached_response(cache_key)
+        if cached is not None:
+            yield "delta", {"content": "", "text": cached.get("text", "")}
+            yield "result", cached
+            return
+
+    streamer = JsonFieldStreamer("text")
+    chunks = []
+    with span("openai.chat_completion_stream", deployment=chat_request["model"]) as attributes:
+        stream = await _pool_complete_async(
+            {**chat_request, "stream": True, "stream_options": {"include_usage": True}}
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                attributes["total_tokens"] = chunk.usage.total_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            piece = chunk.choices[0].delta.content
+            chunks.append(piece)
+            yield "delta", {"content": piece, "text": streamer.feed(piece)}
+    content = await _parse_with_repair_async(chat_request, ["".join(chunks)], _parse_first_choice)
+    if cache_key:
+        ttl = response_cache_ttl(template["settings"]["prompt_template"])
+        if offload:
+            await asyncio.to_thread(store_response, cache_key, content, ttl)
+        else:
+            store_response(cache_key, content, ttl)
+    yield "result", content
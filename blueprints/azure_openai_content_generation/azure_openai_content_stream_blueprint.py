@@ -0,0 +1,45 @@
+from azure.functions.decorators import Blueprint
+from azurefunctions.extensions.http.fastapi import JSONResponse, Request, StreamingResponse
+from blueprints.azure_openai_content_generation.azure_openai_content_generation_blueprint import stream_text_content_logic_async
+from shared.errors import StageError
+from shared.logger import structured_logger
+from shared.utils.stream_utils import NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, STREAM_HEADERS, format_ndjson, format_sse, wants_sse
+from generated_models.models import AzureOpenAIGenerateContentRequest, AzureOpenAIGenerateContentResponse
+
+text_stream_blueprint = Blueprint()
+
+
+@text_stream_blueprint.route(route="generate-text-content-stream", methods=["POST"])
+async def generate_text_content_stream(req: Request) -> StreamingResponse:
+    """
+    Streaming variant of generate-text-content. Emits a "delta" event per model
+    chunk ({"content": raw tokens, "text": newly decoded caption text}) and ends
+    with "result" carrying the AzureOpenAIGenerateContentResponse (or "error").
+    Events are NDJSON lines, or server-sent events with `?format=sse` / `Accept: text/event-stream`.
+    """
+    try:
+        data = await req.json()
+        text_content_request = AzureOpenAIGenerateContentRequest(**data)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    sse = wants_sse(req.query_params, req.headers)
+    events = stream_text_content_events(text_content_request.template, text_content_request.variableValues or {})
+    return StreamingResponse(
+        (format_sse(event) if sse else format_ndjson(event) async for event in events),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        headers=STREAM_HEADERS,
+    )
+
+
+async def stream_text_content_events(template: dict, variable_values: dict):
+    """Yields {"event", "data"} dicts for a streamed generation; failures end the stream with an "error" event."""
+    try:
+        async for event, payload in stream_text_content_logic_async(template, variable_values):
+            if event == "result":
+                payload = AzureOpenAIGenerateContentResponse(**payload).model_dump(mode="json")
+            yield {"event": event, "data": payload}
+    except StageError as e:
+        yield {"event": "error", "data": {"error": str(e), "statusCode": e.status_code}}
+    except Exception as e:
+        structured_logger.error("Streaming text generation error", error=str(e))
+        yield {"event": "error", "data": {"error": str(e), "statusCode": 500}}
@@ -2,8 +2,12 @@ import azure.functions as func
 from azure.functions.decorators import Blueprint
 import os
 import json
-from azure.cosmos import CosmosClient
+from shared.errors import StageError
 from shared.logger import structured_logger
+from shared.tracing import span
+from shared.utils.cosmos_utils import get_container
+from shared.utils.http_utils import get_http_session
+from shared.utils.deployment_pool import get_deployment_pool
 from azure.storage.blob import BlobServiceClient
 # If you have an AI model or service, import it here (e.g., OpenAI, Azure Cognitive Services)
 
@@ -13,154 +17,152 @@ media_search_blueprint = Blueprint()
 def media_search(req: func.HttpRequest) -> func.HttpResponse:
     try:
         data = req.get_json()
-        text_content = data.get("text")
-        source = data.get("source", "internal")  # Accept 'source' param, default to 'internal'
-        if not text_content:
-            return func.HttpResponse(json.dumps({"error": "Missing 'text' in request body."}), status_code=400, mimetype="application/json")
+        result = media_search_logic(data)
+        return func.HttpResponse(json.dumps(result), status_code=200, mimetype="application/json")
+    except StageError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=e.status_code, mimetype="application/json")
+    except Exception as e:
+        structured_logger.error("Media search error", error=str(e))
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
 
-        if source == "online":
-            # --- ONLINE IMAGE SEARCH (Bing Image Search API) ---
-            # You must set BING_IMAGE_SEARCH_KEY in your environment variables
-            subscription_key = os.environ.get("BING_IMAGE_SEARCH_KEY")
-            if not subscription_key:
-                return func.HttpResponse(json.dumps({"error": "Bing Image Search API key not configured."}), status_code=500, mimetype="application/json")
-            search_url = "https://api.bing.microsoft.com/v7.0/images/search"
-            headers = {"Ocp-Apim-Subscription-Key": subscription_key}
-            params = {"q": text_content, "count": 10}
-            import requests
-            try:
-                resp = requests.get(search_url, headers=headers, params=params)
-                if resp.status_code == 200:
-                    results = resp.json().get("value", [])
-                    if not results:
-                        return func.HttpResponse(json.dumps({"error": "No online images found."}), status_code=404, mimetype="application/json")
-                    # Optionally, use AI to rank results here
-                    best_match = results[0]
-                    return func.HttpResponse(json.dumps({"media": best_match, "source": "online"}), status_code=200, mimetype="application/json")
-                else:
-                    return func.HttpResponse(json.dumps({"error": f"Bing Image Search failed: {resp.text}"}), status_code=resp.status_code, mimetype="application/json")
-            except Exception as e:
-                structured_logger.error("Online image search error", error=str(e))
-                return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+def media_search_logic(data: dict) -> dict:
+    """
+    Finds the best matching media for data["text"] from the requested source.
+    Returns a dict with keys: media (or llm_result) and source.
+    Raises StageError with the HTTP status code the route should respond with.
+    """
+    with span("media_search", source=data.get("source", "internal")):
+        return _search_media(data)
 
-        if source == "uploaded":
-            # --- UPLOADED MEDIA SEARCH (Cosmos DB) ---
-            user_id = data.get("userId")
-            brand_id = data.get("brandId")
-            if not user_id or not brand_id:
-                return func.HttpResponse(json.dumps({"error": "Missing 'userId' or 'brandId' in request body."}), status_code=400, mimetype="application/json")
-            cosmos_url = os.environ["COSMOS_DB_CONNECTION_STRING"]
-            db_name = os.environ["COSMOS_DB_NAME"]
-            container_media = os.environ.get("COSMOS_DB_CONTAINER_MEDIA", "media")
-            client = CosmosClient.from_connection_string(cosmos_url)
-            db = client.get_database_client(db_name)
-            media_container = db.get_container_client(container_media)
-            # Search for media by userId, brandId, and text_content in fileName, description, or tags
-            query = (
-                "SELECT * FROM c WHERE c.userId = @userId AND c.brandId = @brandId "
-                "AND (CONTAINS(c.metadata.fileName, @text) "
-                "OR CONTAINS(c.metadata.description, @text) "
-                "OR ARRAY_CONTAINS(c.metadata.tags, {\"name\": @text}, true))"
-            )
-            items = media_container.query_items(
-                query=query,
-                parameters=[
-                    {"name": "@userId", "value": user_id},
-                    {"name": "@brandId", "value": brand_id},
-                    {"name": "@text", "value": text_content}
-                ],
-                enable_cross_partition_query=True
-            )
-            results = list(items)
-            if not results:
-                return func.HttpResponse(json.dumps({"error": "No uploaded media found."}), status_code=404, mimetype="application/json")
-            best_match = results[0]
-            return func.HttpResponse(json.dumps({"media": best_match, "source": "uploaded"}), status_code=200, mimetype="application/json")
+def _search_media(data: dict) -> dict:
+    text_content = data.get("text")
+    source = data.get("source", "internal")  # Accept 'source' param, default to 'internal'
+    if not text_content:
+        raise StageError("Missing 'text' in request body.", 400)
 
-        if source == "uploaded_llm":
-            # --- UPLOADED MEDIA SEARCH WITH LLM RANKING (Cosmos DB + OpenAI) ---
-            user_id = data.get("userId")
-            brand_id = data.get("brandId")
-            if not user_id or not brand_id:
-                return func.HttpResponse(json.dumps({"error": "Missing 'userId' or 'brandId' in request body."}), status_code=400, mimetype="application/json")
-            cosmos_url = os.environ["COSMOS_DB_CONNECTION_STRING"]
-            db_name = os.environ["COSMOS_DB_NAME"]
-            container_media = os.environ.get("COSMOS_DB_CONTAINER_MEDIA", "media")
-            client = CosmosClient.from_connection_string(cosmos_url)
-            db = client.get_database_client(db_name)
-            media_container = db.get_container_client(container_media)
-            # Get all media for user/brand
-            query = (
-                "SELECT c.id, c.metadata.fileName, c.metadata.tags, c.metadata.description FROM c "
-                "WHERE c.userId = @userId AND c.brandId = @brandId"
-            )
-            items = media_container.query_items(
-                query=query,
-                parameters=[
-                    {"name": "@userId", "value": user_id},
-                    {"name": "@brandId", "value": brand_id}
-                ],
-                enable_cross_partition_query=True
-            )
-            media_list = list(items)
-            if not media_list:
-                return func.HttpResponse(json.dumps({"error": "No uploaded media found."}), status_code=404, mimetype="application/json")
-            # Prepare prompt for LLM
-            prompt = f"""Given the following content: \n{text_content}\n\nChoose the best matching media from the list below.\n\n"""
-            for idx, media in enumerate(media_list, 1):
-                tags = ', '.join([t['name'] for t in media.get('tags', [])]) if media.get('tags') else ''
-                prompt += f"{idx}. id: {media.get('id')}, name: {media.get('fileName')}, tags: [{tags}], description: {media.get('description', '')}\n"
-            prompt += "\nReturn the id of the best match and a short reason."
-            # Call OpenAI (Azure) LLM
-            import openai
-            openai.api_type = "azure"
-            openai.api_base = os.environ["AZURE_OPENAI_ENDPOINT"]
-            openai.api_key = os.environ["AZURE_OPENAI_API_KEY"]
-            openai.api_version = os.environ["AZURE_OPENAI_API_VERSION"]
-            deployment = os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"]
-            try:
-                response = openai.ChatCompletion.create(
-                    engine=deployment,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that selects the best matching media for a given content."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=128,
-                    temperature=0.2
-                )
-                answer = response["choices"][0]["message"]["content"]
-                return func.HttpResponse(json.dumps({"llm_result": answer, "source": "uploaded_llm"}), status_code=200, mimetype="application/json")
-            except Exception as e:
-                structured_logger.error("LLM media ranking error", error=str(e))
-                return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+    if source == "online":
+        # --- ONLINE IMAGE SEARCH (Bing Image Search API) ---
+        # You must set BING_IMAGE_SEARCH_KEY in your environment variables
+        subscription_key = os.environ.get("BING_IMAGE_SEARCH_KEY")
+        if not subscription_key:
+            raise StageError("Bing Image Search API key not configured.", 500)
+        search_url = "https://api.bing.microsoft.com/v7.0/images/search"
+        headers = {"Ocp-Apim-Subscription-Key": subscription_key}
+        params = {"q": text_content, "count": 10}
+        try:
+            resp = get_http_session().get(search_url, headers=headers, params=params)
+        except Exception as e:
+            structured_logger.error("Online image search error", error=str(e))
+            raise StageError(str(e), 500)
+        if resp.status_code != 200:
+            raise StageError(f"Bing Image Search failed: {resp.text}", resp.status_code)
+        results = resp.json().get("value", [])
+        if not results:
+            raise StageError("No online images found.", 404)
+        # Optionally, use AI to rank results here
+        best_match = results[0]
+        return {"media": best_match, "source": "online"}
 
-        # --- INTERNAL MEDIA SEARCH (Cosmos DB) ---
-        # Cosmos DB setup for media metadata
-        cosmos_url = os.environ["COSMOS_DB_CONNECTION_STRING"]
-        db_name = os.environ["COSMOS_DB_NAME"]
+    if source == "uploaded":
+        # --- UPLOADED MEDIA SEARCH (Cosmos DB) ---
+        user_id = data.get("userId")
+        brand_id = data.get("brandId")
+        if not user_id or not brand_id:
+            raise StageError("Missing 'userId' or 'brandId' in request body.", 400)
         container_media = os.environ.get("COSMOS_DB_CONTAINER_MEDIA", "media")
-        client = CosmosClient.from_connection_string(cosmos_url)
-        db = client.get_database_client(db_name)
-        media_container = db.get_container_client(container_media)
-
-        # TODO: Use AI to extract keywords/tags from text_content
-        # For now, just use the text as a keyword search
-        query = "SELECT * FROM c WHERE CONTAINS(c.tags, @text) OR CONTAINS(c.description, @text)"
+        media_container = get_container(container_media)
+        # Search for media by userId, brandId, and text_content in fileName, description, or tags
+        query = (
+            "SELECT * FROM c WHERE c.userId = @userId AND c.brandId = @brandId "
+            "AND (CONTAINS(c.metadata.fileName, @text) "
+            "OR CONTAINS(c.metadata.description, @text) "
+            "OR ARRAY_CONTAINS(c.metadata.tags, {\"name\": @text}, true))"
+        )
         items = media_container.query_items(
             query=query,
-            parameters=[{"name": "@text", "value": text_content}],
+            parameters=[
+                {"name": "@userId", "value": user_id},
+                {"name": "@brandId", "value": brand_id},
+                {"name": "@text", "value": text_content}
+            ],
             enable_cross_partition_query=True
         )
         results = list(items)
+        if not results:
+            raise StageError("No uploaded media found.", 404)
+        best_match = results[0]
+        return {"media": best_match, "source": "uploaded"}
+
+    if source == "uploaded_llm":
+        # --- UPLOADED MEDIA SEARCH WITH LLM RANKING (Cosmos DB + OpenAI) ---
+        user_id = data.get("userId")
+        brand_id = data.get("brandId")
+        if not user_id or not brand_id:
+            raise StageError("Missing 'userId' or 'brandId' in request body.", 400)
+        container_media = os.environ.get("COSMOS_DB_CONTAINER_MEDIA", "media")
+        media_container = get_container(container_media)
+        # Get all media for user/brand
+        query = (
+            "SELECT c.id, c.metadata.fileName, c.metadata.tags, c.metadata.description FROM c "
+            "WHERE c.userId = @userId AND c.brandId = @brandId"
+        )
+        items = media_container.query_items(
+            query=query,
+            parameters=[
+                {"name": "@userId", "value": user_id},
+                {"name": "@brandId", "value": brand_id}
+            ],
+            enable_cross_partition_query=True
+        )
+        media_list = list(items)
+        if not media_list:
+            raise StageError("No uploaded media found.", 404)
+        # Prepare prompt for LLM
+        prompt = f"""Given the following content: \n{text_content}\n\nChoose the best matching media from the list below.\n\n"""
+        for idx, media in enumerate(media_list, 1):
+            tags = ', '.join([t['name'] for t in media.get('tags', [])]) if media.get('tags') else ''
+            prompt += f"{idx}. id: {media.get('id')}, name: {media.get('fileName')}, tags: [{tags}], description: {media.get('description', '')}\n"
+        prompt += "\nReturn the id of the best match and a short reason."
+        # Call OpenAI (Azure) LLM through the deployment pool shared with text generation
+        pool = get_deployment_pool()
+        try:
+            response = pool.complete(dict(
+                model=pool.default_deployment,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant that selects the best matching media for a given content."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=128,
+                temperature=0.2
+            ))
+            answer = response.choices[0].message.content
+        except StageError:
+            raise
+        except Exception as e:
+            structured_logger.error("LLM media ranking error", error=str(e))
+            raise StageError(str(e), 500)
+        return {"llm_result": answer, "source": "uploaded_llm"}
 
-        # TODO: Use AI to rank/select the best image from results
-        # For now, just pick the first result
-        best_match = results[0] if results else None
+    # --- INTERNAL MEDIA SEARCH (Cosmos DB) ---
+    # Cosmos DB setup for media metadata
+    container_media = os.environ.get("COSMOS_DB_CONTAINER_MEDIA", "media")
+    media_container = get_container(container_media)
 
-        if not best_match:
-            return func.HttpResponse(json.dumps({"error": "No matching media found."}), status_code=404, mimetype="application/json")
+    # TODO: Use AI to extract keywords/tags from text_content
+    # For now, just use the text as a keyword search
+    query = "SELECT * FROM c WHERE CONTAINS(c.tags, @text) OR CONTAINS(c.description, @text)"
+    items = media_container.query_items(
+        query=query,
+        parameters=[{"name": "@text", "value": text_content}],
+        enable_cross_partition_query=True
+    )
+    results = list(items)
 
-        return func.HttpResponse(json.dumps({"media": best_match, "source": source}), status_code=200, mimetype="application/json")
-    except Exception as e:
-        structured_logger.error("Media search error", error=str(e))
-        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+    # TODO: Use AI to rank/select the best image from results
+    # For now, just pick the first result
+    best_match = results[0] if results else None
+
+    if not best_match:
+        raise StageError("No matching media found.", 404)
+
+    return {"media": best_match, "source": source}
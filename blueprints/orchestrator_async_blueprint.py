@@ -0,0 +1,381 @@
+import asyncio
+import azure.functions as func
+from azure.functions.decorators import Blueprint
+import os
+import json
+import uuid
+from azure.storage.blob import ContentSettings
+from blueprints.azure_openai_content_generation.azure_openai_content_generation_blueprint import generate_text_content_logic_async
+from blueprints.media_search.media_search_blueprint import media_search_logic
+from blueprints.image_generation.image_generation_blueprint import generate_image_logic
+from blueprints.posting.posting_blueprint import get_instagram_account, publish_to_instagram
+from blueprints.orchestrator_blueprint import (
+    PUBLIC_IMAGES_CONTAINER,
+    IDEMPOTENT_REPLAYED_HEADER,
+    CORRELATION_ID_HEADER,
+    checkpoints_enabled,
+    resumable_stage_failure,
+    is_transient_failure,
+    failed_post_result,
+    publish_failed_transiently,
+    debug_template_listing_enabled,
+    timings_requested,
+    with_timings,
+    get_idempotency_key,
+    select_variable_values,
+    pick_visual_style,
+    build_media_search_payload,
+    build_image_payload,
+    build_blob_path,
+    build_public_image_url,
+    build_post_doc,
+    build_response_body,
+)
+from shared.errors import StageError
+from shared.idempotency import post_id_for_key, run_idempotent_async
+from shared.logger import structured_logger
+from shared.post_repository import AsyncPostRepository
+from shared.pipeline import Stage, run_stage_graph, shared_lookup
+from shared.tracing import start_trace
+from shared.utils.azure_blob_utils import get_async_blob_service_client
+from shared.utils.cosmos_utils import get_async_container
+from shared.utils.template_cache import get_template_async
+from generated_models.models import OrchestratorRequest, OrchestratorResponse
+
+orchestrator_async_blueprint = Blueprint()
+
+
+@orchestrator_async_blueprint.route(route="generate-content-orchestrator-async", methods=["POST"])
+async def generate_content_orchestrator_async(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        data = req.get_json()
+        correlation_id = req.headers.get(CORRELATION_ID_HEADER) or str(uuid.uuid4())
+        response_body, replayed = await run_idempotent_orchestration_async(
+            data, user_id=req.headers.get("X-API-Key", "anonymous"), idempotency_key=get_idempotency_key(req, data),
+            correlation_id=correlation_id, include_timings=timings_requested(getattr(req, "params", {}))
+        )
+        response_model = OrchestratorResponse(status="success", result=response_body)
+        headers = {CORRELATION_ID_HEADER: correlation_id}
+        if replayed:
+            headers[IDEMPOTENT_REPLAYED_HEADER] = "true"
+        return func.HttpResponse(response_model.model_dump_json(), status_code=201, mimetype="application/json", headers=headers)
+    except StageError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=e.status_code, mimetype="application/json")
+    except Exception as e:
+        structured_logger.error("Orchestrator error", error=str(e))
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+
+
+@orchestrator_async_blueprint.route(route="generate-content-orchestrator-batch", methods=["POST"])
+async def generate_content_orchestrator_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Generates one post per item of {"items": [OrchestratorRequest, ...], "maxConcurrency": n}.
+    Responds 200 with per-item results in request order; failed items carry their error and status code.
+    """
+    try:
+        data = req.get_json()
+        items = data.get("items")
+        if not isinstance(items, list) or not items:
+            return func.HttpResponse(json.dumps({"error": "Missing 'items' in request body."}), status_code=400, mimetype="application/json")
+        max_items = int(os.environ.get("ORCHESTRATOR_BATCH_MAX_ITEMS", "500"))
+        if len(items) > max_items:
+            return func.HttpResponse(json.dumps({"error": f"A batch may contain at most {max_items} items."}), status_code=400, mimetype="application/json")
+        results = await run_batch_async(
+            items,
+            user_id=req.headers.get("X-API-Key", "anonymous"),
+            max_concurrency=data.get("maxConcurrency"),
+            include_timings=timings_requested(getattr(req, "params", {})),
+        )
+        status = "success" if all(r["status"] == "success" for r in results) else "partial"
+        return func.HttpResponse(json.dumps({"status": status, "results": results}, default=str), status_code=200, mimetype="application/json")
+    except Exception as e:
+        structured_logger.error("Batch orchestrator error", error=str(e))
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+
+
+def get_batch_concurrency(requested=None) -> int:
+    """Requested concurrency, capped by ORCHESTRATOR_BATCH_MAX_CONCURRENCY (default 4)."""
+    limit = int(os.environ.get("ORCHESTRATOR_BATCH_MAX_CONCURRENCY", "4"))
+    if requested:
+        limit = min(limit, int(requested))
+    return max(limit, 1)
+
+
+async def run_batch_async(items: list, user_id: str, max_concurrency=None, include_timings=False) -> list:
+    """
+    Runs the generation pipeline for every item with at most `max_concurrency`
+    pipelines in flight. Items share template and brand lookups.
+    Items may carry an idempotencyKey; each item is traced under its own correlation id.
+    Returns one {"index", "status", "result", "replayed"} or {"index", "status", "error", "statusCode"} dict per item.
+    """
+    semaphore = asyncio.Semaphore(get_batch_concurrency(max_concurrency))
+    shared_lookups = {}
+
+    async def run_item(index, item):
+        async with semaphore:
+            try:
+                result, replayed = await run_idempotent_orchestration_async(
+                    item, user_id=user_id, idempotency_key=item.get("idempotencyKey"), shared_lookups=shared_lookups,
+                    include_timings=include_timings
+                )
+                return {"index": index, "status": "success", "result": result, "replayed": replayed}
+            except StageError as e:
+                return {"index": index, "status": "error", "error": str(e), "statusCode": e.status_code}
+            except Exception as e:
+                structured_logger.error("Batch item failed", error=str(e), index=index)
+                return {"index": index, "status": "error", "error": str(e), "statusCode": 500}
+
+    return await asyncio.gather(*(run_item(index, item) for index, item in enumerate(items)))
+
+
+async def run_idempotent_orchestration_async(
+    data: dict, user_id: str, idempotency_key=None, shared_lookups=None, on_progress=None, correlation_id=None, include_timings=False
+):
+    """
+    Parses an OrchestratorRequest payload and runs it at most once per idempotency key,
+    as one traced run. Returns (response_body, replayed); the body carries the
+    run's `timings` when `include_timings` is set. `on_progress` is passed to run_orchestration_async.
+    """
+    orchestrator_request = OrchestratorRequest(**data)
+    with start_trace(
+        "orchestrator", correlation_id=correlation_id,
+        template_id=orchestrator_request.template_id, brand_id=orchestrator_request.brand_id
+    ) as trace:
+        response_body, replayed = await run_idempotent_async(idempotency_key, lambda: run_orchestration_async(
+            template_id=orchestrator_request.template_id,
+            brand_id=orchestrator_request.brand_id,
+            variable_values=orchestrator_request.variable_values or {},
+            user_id=user_id,
+            shared_lookups=shared_lookups,
+            post_id=post_id_for_key(idempotency_key) if idempotency_key else None,
+            on_progress=on_progress,
+        ))
+    if include_timings:
+        response_body = with_timings(response_body, trace)
+    return response_body, replayed
+
+
+async def run_orchestration_async(template_id: str, brand_id: str, variable_values: dict, user_id: str, shared_lookups=None, post_id=None, on_progress=None) -> dict:
+    """
+    Runs the generation pipeline as a stage graph so independent work overlaps:
+    the brand/Instagram account lookup (and the opt-in template listing) run
+    alongside template read and text generation, theme selection runs alongside the LLM call,
+    and the post document write runs alongside publishing (before it in resumable runs, which
+    record a successful publish on the post at once). Media search, rendering
+    and publishing always run in-process (CPU/blocking work on worker threads).
+    Runs that pass the same `shared_lookups` dict (e.g. items of one batch) share
+    template and brand reads. A run given a stable `post_id` (idempotent runs)
+    checkpoints stage outputs on the post document, stops with StageError(502) at the first
+    stage that fails transiently and skips completed stages on retry.
+    `on_progress(event, data)`, if given, is called as partial results become
+    available: "text" with the generated content, "image" with {"imageUrl"} and
+    "post" with the posting result.
+    Returns the OrchestratorResponse result dict. Raises StageError(404) for an unknown template.
+    """
+    templates_container = get_async_container(os.environ.get("COSMOS_DB_CONTAINER_TEMPLATES", "templates"))
+    post_repository = AsyncPostRepository()
+    brands_container = get_async_container(os.environ.get("COSMOS_DB_CONTAINER_BRAND", "brands"))
+    resumable = post_id is not None and checkpoints_enabled()
+    post_id = post_id or str(uuid.uuid4())
+    checkpoints = {}
+    publish_error = None
+
+    def report(event, data):
+        if on_progress is not None:
+            on_progress(event, data)
+
+    async def load_checkpoints(results):
+        if resumable:
+            checkpoints.update(await post_repository.load_checkpoints(post_id))
+        if checkpoints:
+            structured_logger.info("Resuming from stage checkpoints", post_id=post_id, stages=list(checkpoints))
+
+    async def list_templates(results):
+        # Debug: List all template IDs for this brandId (partition key)
+        try:
+            query = "SELECT c.id, c.templateInfo.brandId FROM c WHERE c.templateInfo.brandId = @brandId"
+            items = [item async for item in templates_container.query_items(
+                query=query,
+                parameters=[{"name": "@brandId", "value": brand_id}]
+            )]
+            template_ids = [item["id"] for item in items]
+            structured_logger.info("Templates found for brandId", brand_id=brand_id, template_ids=template_ids)
+        except Exception as debug_e:
+            structured_logger.error("Debug query failed", error=str(debug_e), brand_id=brand_id)
+
+    async def load_template(results):
+        # Partition key is templateInfo.brandId
+        try:
+            return await shared_lookup(
+                shared_lookups, ("template", brand_id, template_id),
+                lambda: get_template_async(templates_container, brand_id, template_id)
+            )
+        except Exception as e:
+            structured_logger.error("Template not found", error=str(e), template_id=template_id)
+            raise StageError(f"Template with id {template_id} not found.", 404)
+
+    async def load_instagram_account(results):
+        try:
+            brand_db = await shared_lookup(
+                shared_lookups, ("brand", brand_id),
+                lambda: brands_container.read_item(item=brand_id, partition_key=brand_id)
+            )
+            return get_instagram_account(brand_db)
+        except Exception as e:
+            structured_logger.error("Brand/Instagram account not found", error=str(e), brand_id=brand_id)
+            return None
+
+    async def prepare_style(results):
+        return pick_visual_style(results["template"].get("settings", {}))
+
+    async def generate_text(results):
+        if "text" in checkpoints:
+            report("text", checkpoints["text"])
+            return checkpoints["text"]
+        settings = results["template"].get("settings", {})
+        prompt_template = settings.get("prompt_template", {})
+        content = await generate_text_content_logic_async(
+            {"settings": settings}, select_variable_values(prompt_template, variable_values)
+        )
+        if resumable:
+            checkpoints["text"] = content
+            await post_repository.save(build_post_doc(post_id, brand_id, template_id, content, None, checkpoints=checkpoints))
+        report("text", content)
+        return content
+
+    async def search_media(results):
+        if "media" in checkpoints:
+            return checkpoints["media"]
+        content_type = results["template"].get("templateInfo", {}).get("contentType", "text")
+        if content_type != "image":
+            return None
+        media_url = None
+        try:
+            media_result = await asyncio.to_thread(media_search_logic, build_media_search_payload(results["text"], brand_id))
+            # Assume media_result["url"] is the best image URL
+            media_url = media_result.get("url")
+        except Exception as e:
+            # No match and other 4xx answers mean "no media"; only transient failures are retried
+            structured_logger.warning("Media search failed", error=str(e), status_code=getattr(e, "status_code", None))
+            if resumable and is_transient_failure(e):
+                raise resumable_stage_failure("media", e) from e
+        if resumable:
+            checkpoints["media"] = media_url
+            await post_repository.record_checkpoint(post_id, "media", media_url)
+        return media_url
+
+    async def render_image(results):
+        if "image" in checkpoints:
+            return None  # Already rendered and uploaded by an earlier attempt
+        settings = results["template"].get("settings", {})
+        image_payload = build_image_payload(results["text"], settings, results["style"], results["media"])
+        try:
+            return await asyncio.to_thread(generate_image_logic, image_payload)
+        except Exception as e:
+            structured_logger.error("Image generation failed", error=str(e))
+            if resumable:
+                raise resumable_stage_failure("render", e) from e
+            return None
+
+    async def upload_image(results):
+        image_url = await store_image(results)
+        report("image", {"imageUrl": image_url})
+        return image_url
+
+    async def store_image(results):
+        if "image" in checkpoints:
+            return checkpoints["image"]
+        if not results["render"]:
+            return None
+        try:
+            blob_service_client = get_async_blob_service_client(os.environ.get("PUBLIC_BLOB_CONNECTION_STRING"))
+            try:
+                await blob_service_client.create_container(PUBLIC_IMAGES_CONTAINER)
+            except Exception:
+                pass  # Container may already exist
+            blob_path = build_blob_path(user_id, brand_id, template_id, post_id)
+            blob_client = blob_service_client.get_blob_client(container=PUBLIC_IMAGES_CONTAINER, blob=blob_path)
+            await blob_client.upload_blob(results["render"], overwrite=True, content_settings=ContentSettings(content_type="image/png"))
+            image_url = build_public_image_url(blob_service_client.url, blob_path)
+        except Exception as e:
+            structured_logger.error("Blob upload failed", error=str(e))
+            if resumable:
+                raise resumable_stage_failure("upload", e) from e
+            return None
+        if resumable:
+            checkpoints["image"] = image_url
+            await post_repository.record_checkpoint(post_id, "image", image_url, {"imageUrl": image_url})
+        return image_url
+
+    async def save_post(results):
+        post_doc = build_post_doc(
+            post_id, brand_id, template_id, results["text"], results["upload"], checkpoints.get("publish"),
+            checkpoints=dict(checkpoints) if resumable else None
+        )
+        # Upsert: a retried idempotent run reuses the same post id
+        saved = await post_repository.save(post_doc)
+        structured_logger.info("Content written to Cosmos DB", post_id=post_id)
+        return saved
+
+    async def publish(results):
+        if "publish" in checkpoints:
+            post_result = checkpoints["publish"]
+        else:
+            post_result = await publish_post(results)
+            if resumable and post_result.get("instagramPostId"):
+                # Recorded at once (the post was saved before publishing), so a later failure
+                # cannot make the retry publish the post a second time
+                checkpoints["publish"] = post_result
+                try:
+                    await post_repository.record_publish_result(post_id, post_result, checkpoint=True)
+                except Exception as e:
+                    structured_logger.error("Failed to record publish checkpoint", error=str(e), post_id=post_id)
+        report("post", post_result)
+        return post_result
+
+    async def publish_post(results):
+        nonlocal publish_error
+        if results["instagram_account"] is None:
+            return failed_post_result("Instagram account not found")
+        try:
+            return await asyncio.to_thread(publish_to_instagram, results["instagram_account"], results["upload"], results["text"])
+        except Exception as e:
+            structured_logger.error("Posting failed", error=str(e), post_id=post_id)
+            publish_error = e
+            return failed_post_result(e)
+
+    async def record_publish(results):
+        # Patch the Instagram post id and status onto the post written concurrently with publishing,
+        # conditional on the ETag from that write so concurrent updates are not lost
+        post_result = results["publish"] or {}
+        try:
+            # A resumable run already recorded a successful publish in the publish stage
+            if not (resumable and post_result.get("instagramPostId")) and (
+                post_result.get("instagramPostId") or post_result.get("postStatus")
+            ):
+                etag = (results["save_post"] or {}).get("_etag")
+                await post_repository.record_publish_result(post_id, post_result, etag=etag)
+        except Exception as e:
+            structured_logger.error("Failed to update post with Instagram info", error=str(e))
+        if resumable and publish_failed_transiently(post_result, publish_error):
+            # Raised after the failed status is recorded; the publish stage is retried on resume
+            raise resumable_stage_failure("publish", publish_error or post_result.get("instagramResult"))
+
+    stages = [
+        Stage("checkpoints", load_checkpoints),
+        Stage("template", load_template),
+        Stage("instagram_account", load_instagram_account),
+        Stage("style", prepare_style, depends_on=("template",)),
+        Stage("text", generate_text, depends_on=("template", "checkpoints")),
+        Stage("media", search_media, depends_on=("template", "text")),
+        Stage("render", render_image, depends_on=("template", "style", "text", "media")),
+        Stage("upload", upload_image, depends_on=("render",)),
+        Stage("save_post", save_post, depends_on=("text", "upload")),
+        # A resumable run saves the post before publishing, so the publish checkpoint can be patched onto it
+        Stage("publish", publish, depends_on=("instagram_account", "text", "upload", "checkpoints") + (("save_post",) if resumable else ())),
+        Stage("record_publish", record_publish, depends_on=("save_post", "publish")),
+    ]
+    if debug_template_listing_enabled():
+        stages.append(Stage("template_listing", list_templates))
+    results = await run_stage_graph(stages)
+    return build_response_body(post_id, results["text"], results["upload"], results["publish"], results["media"])
@@ -2,39 +2,340 @@ import azure.functions as func
 from azure.functions.decorators import Blueprint
 import os
 import json
-from azure.cosmos import CosmosClient
 from datetime import datetime
 from blueprints.azure_openai_content_generation.azure_openai_content_generation_blueprint import generate_text_content_logic
+from blueprints.media_search.media_search_blueprint import media_search_logic
+from blueprints.image_generation.image_generation_blueprint import generate_image_logic
+from blueprints.posting.posting_blueprint import is_transient_posting_failure, post_content_logic
+from shared.errors import StageError
+from shared.idempotency import post_id_for_key, run_idempotent
 from shared.logger import structured_logger
+from shared.post_repository import PostRepository
+from shared.tracing import span, start_trace
+from shared.utils.azure_blob_utils import get_blob_service_client
+from shared.utils.cosmos_utils import get_container
+from shared.utils.http_utils import get_http_session
+from shared.utils.prompt_template import select_variable_values
+from shared.utils.template_cache import get_template
 import random
-import requests
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob import ContentSettings
 import uuid
 from generated_models.models import OrchestratorRequest, OrchestratorResponse
 
 orchestrator_blueprint = Blueprint()
 
+PUBLIC_IMAGES_CONTAINER = "public-images"
+
+# How the orchestrator reaches the media-search, image and posting stages:
+# "inprocess" calls their logic functions directly, "http" loops back through
+# the Functions host at API_BASE_URL (the original behaviour).
+DISPATCH_INPROCESS = "inprocess"
+DISPATCH_HTTP = "http"
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# Set on responses replayed from the idempotency store instead of freshly generated
+IDEMPOTENT_REPLAYED_HEADER = "Idempotent-Replayed"
+# Caller-supplied id tying the run's logs and timing summary together; generated when absent
+CORRELATION_ID_HEADER = "X-Correlation-ID"
+# postStatus of a pre-generated post waiting for its scheduled slot
+POST_STATUS_DRAFT = "draft"
+# postStatus of a post whose publishing failed
+POST_STATUS_FAILED = "failed"
+
+
+def get_dispatch_mode() -> str:
+    return os.environ.get("ORCHESTRATOR_DISPATCH_MODE", DISPATCH_INPROCESS).lower()
+
+
+def checkpoints_enabled() -> bool:
+    """Stage checkpointing for idempotent runs can be turned off with ORCHESTRATOR_CHECKPOINTS=false."""
+    return os.environ.get("ORCHESTRATOR_CHECKPOINTS", "true").lower() in ("1", "true", "yes")
+
+
+def timings_requested(params) -> bool:
+    """Per-stage timings are added to the response as `timings` with ?timings=true."""
+    return str(params.get("timings", "")).lower() in ("1", "true", "yes")
+
+
+def debug_template_listing_enabled() -> bool:
+    """The per-request listing of every template ID for the brand is opt-in (ORCHESTRATOR_DEBUG_TEMPLATE_LISTING=true)."""
+    return os.environ.get("ORCHESTRATOR_DEBUG_TEMPLATE_LISTING", "false").lower() in ("1", "true", "yes")
+
+
+def _post_to_stage(route: str, payload: dict):
+    api_base_url = os.environ.get("API_BASE_URL", "http://localhost:7071/api")
+    resp = get_http_session().post(f"{api_base_url}/{route}", json=payload)
+    if resp.status_code != 200:
+        raise StageError(resp.text, resp.status_code)
+    return resp
+
+
+def dispatch_media_search(payload: dict) -> dict:
+    """Runs the media-search stage and returns its result dict. Raises StageError on failure."""
+    if get_dispatch_mode() == DISPATCH_HTTP:
+        return _post_to_stage("media-search", payload).json()
+    return media_search_logic(payload)
+
+
+def dispatch_generate_image(payload: dict) -> bytes:
+    """Runs the image-render stage and returns the encoded image bytes. Raises StageError on failure."""
+    if get_dispatch_mode() == DISPATCH_HTTP:
+        return _post_to_stage("generate-image", payload).content
+    try:
+        return generate_image_logic(payload)
+    except StageError:
+        raise
+    except Exception as e:
+        raise StageError(f"Error: {str(e)}", 500)
+
+
+def dispatch_post_content(payload: dict) -> dict:
+    """Runs the posting stage and returns instagramResult/instagramPostId/postStatus. Raises StageError on failure."""
+    if get_dispatch_mode() == DISPATCH_HTTP:
+        return posting_response_to_result(_post_to_stage("post-content", payload).json())
+    return post_content_logic(payload)
+
+
+def posting_response_to_result(posting_response: dict) -> dict:
+    """
+    Maps a PostingResponse body (status, post_url, error) to the instagramResult/instagramPostId/postStatus
+    dict post_content_logic returns, so both dispatch modes hand the pipeline the same shape.
+    Over HTTP only the Graph API error survives, so instagramResult carries just that.
+    """
+    error = posting_response.get("error")
+    return {
+        "instagramResult": {"error": error} if error else None,
+        "instagramPostId": posting_response.get("post_url") or posting_response.get("postUrl"),
+        "postStatus": posting_response.get("status"),
+    }
+
+
+# --- Pipeline helpers shared by the sync and async orchestrators ---
+
+def pick_visual_style(settings: dict):
+    """If visualStyle has a 'themes' array, pick a random theme."""
+    visual_style = settings.get("visualStyle", {})
+    if (
+        isinstance(visual_style, dict)
+        and "themes" in visual_style
+        and isinstance(visual_style["themes"], list)
+        and visual_style["themes"]
+    ):
+        visual_style = random.choice(visual_style["themes"])
+    return visual_style
+
+
+def get_content_text(content) -> str:
+    """Only the 'text' field goes to media search and the image generator, handling both 'text' and 'Text' keys."""
+    if isinstance(content, dict):
+        if "text" in content:
+            return content["text"]
+        if "Text" in content:
+            return content["Text"]
+    return str(content)
+
+
+def build_media_search_payload(content, brand_id: str) -> dict:
+    # media_search_logic searches for the post's text
+    return {"text": get_content_text(content), "brandId": brand_id}
+
+
+def build_image_payload(content, settings: dict, visual_style, media_url=None) -> dict:
+    image_payload = {
+        "text": get_content_text(content),
+        "visualStyle": visual_style,
+        "image": settings.get("image", {}),
+        "boxText": settings.get("boxText", ""),
+        "textBox": settings.get("textBox", {})
+    }
+    # If we have a media_search image, add it to the payload
+    if media_url:
+        image_payload["mediaUrl"] = media_url
+    return image_payload
+
+
+def build_blob_path(user_id: str, brand_id: str, template_id: str, post_id: str) -> str:
+    return f"{user_id}/{brand_id}/{template_id}/{post_id}.png"
+
+
+def build_public_image_url(account_url: str, blob_path: str) -> str:
+    return f"{account_url.rstrip('/')}/{PUBLIC_IMAGES_CONTAINER.strip('/')}/{blob_path.lstrip('/')}"
+
+
+def build_post_doc(post_id: str, brand_id: str, template_id: str, content, image_url, post_result=None, checkpoints=None) -> dict:
+    """
+    Builds the posts container document; Instagram fields are included when `post_result` is known
+    and stage checkpoints when the run is resumable.
+    """
+    now = datetime.utcnow().isoformat()
+    post_doc = {
+        "id": post_id,
+        "brandId": brand_id,
+        "templateId": template_id,
+        "content": content,
+        "createdAt": now,
+        "metadata": {
+            "createdDate": now,
+            "updatedDate": now,
+            "isActive": True
+        },
+        "imageUrl": image_url
+    }
+    if post_result and (post_result.get("instagramPostId") or post_result.get("postStatus")):
+        post_doc["instagramPostId"] = post_result.get("instagramPostId")
+        post_doc["postStatus"] = post_result.get("postStatus")
+    if checkpoints is not None:
+        post_doc["checkpoints"] = checkpoints
+    return post_doc
+
+
+def build_response_body(post_id: str, content, image_url, post_result, media_url=None) -> dict:
+    """Builds the OrchestratorResponse result, adding the Instagram post result when present."""
+    post_result = post_result or {}
+    response_body = {"id": post_id, "content": content, "imageUrl": image_url}
+    if post_result.get("instagramResult"):
+        response_body["instagramResult"] = post_result["instagramResult"]
+    if post_result.get("instagramPostId"):
+        response_body["instagramPostId"] = post_result["instagramPostId"]
+    if post_result.get("postStatus"):
+        response_body["postStatus"] = post_result["postStatus"]
+    if media_url:
+        response_body["mediaSearchImageUrl"] = media_url
+    return response_body
+
+
+def resumable_stage_failure(stage: str, error) -> StageError:
+    """
+    Error that ends a resumable run at a failed stage. Completed stages are already checkpointed;
+    raising (instead of returning a failed result) makes run_idempotent release the idempotency key,
+    so a retry with the same key resumes from the checkpoints rather than replaying the failure.
+    """
+    return StageError(f"Stage '{stage}' failed: {error}. Retry with the same idempotency key to resume.", 502)
+
+
+def is_transient_failure(error) -> bool:
+    """
+    Whether a stage error may succeed on retry: 5xx and 429 StageErrors, and errors
+    raised without a status (network, storage). Other 4xx answers would fail again.
+    """
+    if isinstance(error, StageError):
+        return error.status_code >= 500 or error.status_code == 429
+    return True
+
+
+def failed_post_result(error) -> dict:
+    """Posting result recorded when the publish stage raised instead of returning one."""
+    return {"instagramResult": {"error": str(error)}, "instagramPostId": None, "postStatus": POST_STATUS_FAILED}
+
+
+def publish_failed_transiently(post_result: dict, error=None) -> bool:
+    """
+    Whether an unsuccessful publish should end a resumable run so a retry publishes again.
+    Permanent failures (no account or token, no image, rejected media) are recorded as failed instead.
+    """
+    if error is not None:
+        return is_transient_failure(error)
+    return not (post_result or {}).get("instagramPostId") and is_transient_posting_failure(post_result)
+
+
+def with_timings(response_body: dict, trace) -> dict:
+    """Copy of the response body with the run's `timings`; the stored idempotent result is left without them."""
+    return {**response_body, "timings": trace.timings()}
+
+
+def upload_post_image(image_bytes: bytes, blob_path: str) -> str:
+    """Uploads a rendered post image to the public images container and returns its URL."""
+    blob_conn_str = os.environ.get("PUBLIC_BLOB_CONNECTION_STRING")
+    blob_service_client = get_blob_service_client(blob_conn_str)
+    try:
+        blob_service_client.create_container(PUBLIC_IMAGES_CONTAINER)
+    except Exception:
+        pass  # Container may already exist
+    blob_client = blob_service_client.get_blob_client(container=PUBLIC_IMAGES_CONTAINER, blob=blob_path)
+    with span("blob.upload", bytes=len(image_bytes)):
+        blob_client.upload_blob(image_bytes, overwrite=True, content_settings=ContentSettings(content_type="image/png"))
+    return build_public_image_url(blob_service_client.url, blob_path)
+
+
+def get_idempotency_key(req, data: dict):
+    """Idempotency key from the Idempotency-Key header or the body's idempotencyKey field."""
+    return req.headers.get(IDEMPOTENCY_KEY_HEADER) or data.get("idempotencyKey")
+
+
 @orchestrator_blueprint.route(route="generate-content-orchestrator", methods=["POST"])
 def generate_content_orchestrator(req: func.HttpRequest) -> func.HttpResponse:
     try:
         data = req.get_json()
         orchestrator_request = OrchestratorRequest(**data)
-        template_id = orchestrator_request.template_id
-        variable_values = orchestrator_request.variable_values or {}
-        brand_id = orchestrator_request.brand_id
         user_id = req.headers.get("X-API-Key", "anonymous")
+        idempotency_key = get_idempotency_key(req, data)
+        with start_trace(
+            "orchestrator", correlation_id=req.headers.get(CORRELATION_ID_HEADER),
+            template_id=orchestrator_request.template_id, brand_id=orchestrator_request.brand_id
+        ) as trace:
+            response_body, replayed = run_idempotent(idempotency_key, lambda: run_orchestration(
+                template_id=orchestrator_request.template_id,
+                brand_id=orchestrator_request.brand_id,
+                variable_values=orchestrator_request.variable_values or {},
+                user_id=user_id,
+                post_id=post_id_for_key(idempotency_key) if idempotency_key else None,
+            ))
+        if timings_requested(getattr(req, "params", {})):
+            response_body = with_timings(response_body, trace)
+
+        # Use OrchestratorResponse for serialization
+        response_model = OrchestratorResponse(status="success", result=response_body)
+        headers = {CORRELATION_ID_HEADER: trace.correlation_id}
+        if replayed:
+            headers[IDEMPOTENT_REPLAYED_HEADER] = "true"
+        return func.HttpResponse(response_model.model_dump_json(), status_code=201, mimetype="application/json", headers=headers)
+    except StageError as e:
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=e.status_code, mimetype="application/json")
+    except Exception as e:
+        structured_logger.error("Orchestrator error", error=str(e))
+        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+
+
+def pregenerate_post(template_id: str, brand_id: str, variable_values: dict, idempotency_key: str, user_id: str = "anonymous"):
+    """
+    Runs every stage except publishing for the run that `idempotency_key` will start later,
+    leaving a draft post with its stage checkpoints. That run then resumes from the
+    checkpoints and only publishes. Returns the draft's result dict, or None when
+    checkpoints are disabled (there would be nothing to resume from).
+    """
+    if not checkpoints_enabled():
+        structured_logger.warning("Pre-generation skipped; ORCHESTRATOR_CHECKPOINTS is disabled", template_id=template_id)
+        return None
+    with start_trace("pregenerate", template_id=template_id, brand_id=brand_id):
+        return run_orchestration(
+            template_id, brand_id, variable_values, user_id,
+            post_id=post_id_for_key(idempotency_key), publish=False
+        )
+
 
-        # Cosmos DB setup
-        cosmos_url = os.environ["COSMOS_DB_CONNECTION_STRING"]
-        db_name = os.environ["COSMOS_DB_NAME"]
-        container_templates = os.environ.get("COSMOS_DB_CONTAINER_TEMPLATES", "templates")
-        container_posts = os.environ["COSMOS_DB_CONTAINER_POSTS"]
-        client = CosmosClient.from_connection_string(cosmos_url)
-        db = client.get_database_client(db_name)
-        templates_container = db.get_container_client(container_templates)
-        posts_container = db.get_container_client(container_posts)
-
-        # Debug: List all template IDs for this brandId (partition key)
+def run_orchestration(template_id: str, brand_id: str, variable_values: dict, user_id: str, post_id=None, publish=True) -> dict:
+    """
+    Runs the generation pipeline: template, text, media search, image, upload, posting and post write.
+    A run given a stable `post_id` (idempotent runs) checkpoints each stage's output on the
+    post document, stops with StageError(502) at the first stage that fails transiently and
+    resumes from that stage when retried; other runs, and permanent failures, are logged and
+    the run carries on (a permanent posting failure is saved with postStatus "failed").
+    With `publish=False` the posting stage is skipped and the post is saved as a draft.
+    Returns the OrchestratorResponse result dict. Raises StageError(404) for an unknown template.
+    """
+    # Cosmos DB setup (pooled per worker process)
+    container_templates = os.environ.get("COSMOS_DB_CONTAINER_TEMPLATES", "templates")
+    templates_container = get_container(container_templates)
+    post_repository = PostRepository()
+    resumable = post_id is not None and checkpoints_enabled()
+    post_id = post_id or str(uuid.uuid4())  # Ensure post_id is always set
+    with span("stage.checkpoints"):
+        checkpoints = post_repository.load_checkpoints(post_id) if resumable else {}
+    if checkpoints:
+        structured_logger.info("Resuming from stage checkpoints", post_id=post_id, stages=list(checkpoints))
+
+    # Debug: List all template IDs for this brandId (partition key)
+    if debug_template_listing_enabled():
         try:
             query = "SELECT c.id, c.templateInfo.brandId FROM c WHERE c.templateInfo.brandId = @brandId"
             items = list(templates_container.query_items(
@@ -47,193 +348,134 @@ def generate_content_orchestrator(req: func.HttpRequest) -> func.HttpResponse:
         except Exception as debug_e:
             structured_logger.error("Debug query failed", error=str(debug_e), brand_id=brand_id)
 
-        # Fetch template from Cosmos DB (partition key is templateInfo.brandId)
+    # Fetch template (cached; partition key is templateInfo.brandId)
+    try:
+        with span("stage.template"):
+            template_db = get_template(templates_container, brand_id, template_id)
+    except Exception as e:
+        structured_logger.error("Template not found", error=str(e), template_id=template_id)
+        raise StageError(f"Template with id {template_id} not found.", 404)
+
+    # Extract only the required fields for text generation
+    settings = template_db.get("settings", {})
+    prompt_template = settings.get("prompt_template", {})
+    template = {
+        "settings": settings
+    }
+    if "text" in checkpoints:
+        content = checkpoints["text"]
+    else:
+        with span("stage.text"):
+            content = generate_text_content_logic(template, select_variable_values(prompt_template, variable_values))
+            if resumable:
+                checkpoints["text"] = content
+                post_repository.save(build_post_doc(post_id, brand_id, template_id, content, None, checkpoints=checkpoints))
+
+    # --- Media Search Integration for Images ---
+    content_type = template_db.get("templateInfo", {}).get("contentType", "text")
+    image_url_for_generation = checkpoints.get("media")
+    if content_type == "image" and "media" not in checkpoints:
+        # Try to get a relevant image from media_search
         try:
-            template_db = templates_container.read_item(item=template_id, partition_key=brand_id)
+            with span("stage.media", dispatch_mode=get_dispatch_mode()):
+                media_result = dispatch_media_search(build_media_search_payload(content, brand_id))
+            # Assume media_result["url"] is the best image URL
+            image_url_for_generation = media_result.get("url")
         except Exception as e:
-            structured_logger.error("Template not found", error=str(e), template_id=template_id)
-            return func.HttpResponse(json.dumps({"error": f"Template with id {template_id} not found."}), status_code=404, mimetype="application/json")
-
-        # Extract only the required fields for text generation
-        settings = template_db.get("settings", {})
-        prompt_template = settings.get("prompt_template", {})
-        variable_values_random = {}
-        # Randomly select one value for each variable, if variables exist
-        variables = prompt_template.pop("variables", None)
-        if variables:
-            for var in variables:
-                name = var.get("name")
-                values = var.get("values", [])
-                if name and values:
-                    variable_values_random[name] = random.choice(values)
-        template = {
-            "settings": settings
-        }
-        # Use the randomly selected variable values if present
-        content = generate_text_content_logic(template, variable_values_random or variable_values)
-
-        # --- Media Search Integration for Images ---
-        visual_style = settings.get("visualStyle", {})
-        content_type = template_db.get("templateInfo", {}).get("contentType", "text")
-        image_url_for_generation = None
-        if content_type == "image":
-            # Try to get a relevant image from media_search
-            try:
-                api_base_url = os.environ.get("API_BASE_URL", "http://localhost:7071/api")
-                media_search_url = f"{api_base_url}/media-search"
-                # Use the text content as the search query
-                search_query = content["text"] if isinstance(content, dict) and "text" in content else str(content)
-                resp = requests.post(media_search_url, json={"query": search_query, "brandId": brand_id})
-                if resp.status_code == 200:
-                    media_result = resp.json()
-                    # Assume media_result["url"] is the best image URL
-                    image_url_for_generation = media_result.get("url")
-            except Exception as e:
-                structured_logger.error("Media search failed", error=str(e))
-
-        # --- Image Generation ---
-        # If visualStyle has a 'themes' array, pick a random theme
-        if (
-            isinstance(visual_style, dict)
-            and "themes" in visual_style
-            and isinstance(visual_style["themes"], list)
-            and visual_style["themes"]
-        ):
-            visual_style = random.choice(visual_style["themes"])
-        image = settings.get("image", {})
-        api_base_url = os.environ.get("API_BASE_URL", "http://localhost:7071/api")
-        image_gen_url = f"{api_base_url}/generate-image"
-        # Only pass the 'text' field to the image generator, handling both 'text' and 'Text' keys
-        image_text = None
-        if isinstance(content, dict):
-            if "text" in content:
-                image_text = content["text"]
-            elif "Text" in content:
-                image_text = content["Text"]
-            else:
-                image_text = str(content)
-        else:
-            image_text = str(content)
-        box_text = settings.get("boxText", "")
-        text_box = settings.get("textBox", {})
-        image_payload = {
-            "text": image_text,
-            "visualStyle": visual_style,
-            "image": image,
-            "boxText": box_text,
-            "textBox": text_box
-        }
-        # If we have a media_search image, add it to the payload
-        if image_url_for_generation:
-            image_payload["mediaUrl"] = image_url_for_generation
+            # No match and other 4xx answers mean "no media"; only transient failures are retried
+            structured_logger.warning("Media search failed", error=str(e), status_code=getattr(e, "status_code", None))
+            if resumable and is_transient_failure(e):
+                raise resumable_stage_failure("media", e) from e
+        if resumable:
+            checkpoints["media"] = image_url_for_generation
+            post_repository.record_checkpoint(post_id, "media", image_url_for_generation)
+
+    # --- Image Generation ---
+    image_url = checkpoints.get("image")
+    if "image" not in checkpoints:
+        image_payload = build_image_payload(content, settings, pick_visual_style(settings), image_url_for_generation)
         image_bytes = None
-        post_id = str(uuid.uuid4())  # Ensure post_id is always set
         try:
-            resp = requests.post(image_gen_url, json=image_payload)
-            if resp.status_code == 200:
-                image_bytes = resp.content
-            else:
-                structured_logger.error("Image generation failed", status_code=resp.status_code, response=resp.text)
+            with span("stage.render", dispatch_mode=get_dispatch_mode()):
+                image_bytes = dispatch_generate_image(image_payload)
+        except StageError as e:
+            structured_logger.error("Image generation failed", status_code=e.status_code, response=str(e))
+            if resumable:
+                raise resumable_stage_failure("render", e) from e
         except Exception as e:
             structured_logger.error("Image generation request error", error=str(e))
+            if resumable:
+                raise resumable_stage_failure("render", e) from e
 
         # Upload image to Azure Blob Storage if generated
-        image_url = None
         if image_bytes:
             try:
-                blob_conn_str = os.environ.get("PUBLIC_BLOB_CONNECTION_STRING")
-                blob_service_client = BlobServiceClient.from_connection_string(blob_conn_str)
-                container_name = "public-images"
-                try:
-                    blob_service_client.create_container(container_name)
-                except Exception:
-                    pass  # Container may already exist
-                blob_path = f"{user_id}/{brand_id}/{template_id}/{post_id}.png"
-                blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-                blob_client.upload_blob(image_bytes, overwrite=True, content_settings=ContentSettings(content_type="image/png"))
-                account_url = blob_service_client.url.rstrip('/')
-                container_name_clean = container_name.strip('/')
-                blob_path_clean = blob_path.lstrip('/')
-                image_url = f"{account_url}/{container_name_clean}/{blob_path_clean}"
+                with span("stage.upload"):
+                    image_url = upload_post_image(image_bytes, build_blob_path(user_id, brand_id, template_id, post_id))
             except Exception as e:
                 structured_logger.error("Blob upload failed", error=str(e))
+                if resumable:
+                    raise resumable_stage_failure("upload", e) from e
                 image_url = None
+        if resumable and image_url:
+            checkpoints["image"] = image_url
+            post_repository.record_checkpoint(post_id, "image", image_url, {"imageUrl": image_url})
 
-        # Write to Cosmos DB (posts container)
-        post_doc = {
-            "id": post_id,
+    # --- Instagram Posting Logic moved to posting_blueprint ---
+    post_result = checkpoints.get("publish")
+    publish_error = None
+    if "publish" not in checkpoints and not publish:
+        # Pre-generated: the run at slot time resumes from the checkpoints and only publishes
+        post_result = {"postStatus": POST_STATUS_DRAFT}
+    elif "publish" not in checkpoints:
+        post_payload = {
             "brandId": brand_id,
-            "templateId": template_id,
+            "imageUrl": image_url,
             "content": content,
-            "createdAt": datetime.utcnow().isoformat(),
-            "metadata": {
-                "createdDate": datetime.utcnow().isoformat(),
-                "updatedDate": datetime.utcnow().isoformat(),
-                "isActive": True
-            },
-            "imageUrl": image_url
+            "postId": post_id
         }
-        posts_container.create_item(post_doc)
-        structured_logger.info("Content written to Cosmos DB", post_id=post_id)
-
-        # --- Instagram Posting Logic moved to posting_blueprint ---
-        instagram_post_result = None
-        instagram_post_id = None
-        post_status = None
         try:
-            posting_url = f"{api_base_url}/post-content"
-            post_payload = {
-                "brandId": brand_id,
-                "imageUrl": image_url,
-                "content": content,
-                "postId": post_id
-            }
-            resp = requests.post(posting_url, json=post_payload)
-            if resp.status_code == 200:
-                post_result = resp.json()
-                instagram_post_result = post_result.get("instagramResult")
-                instagram_post_id = post_result.get("instagramPostId")
-                post_status = post_result.get("postStatus")
-            else:
-                structured_logger.error(
-                    "Posting blueprint failed",
-                    status_code=resp.status_code,
-                    response=resp.text,
-                    request_url=posting_url,
-                    request_payload=post_payload
-                )
+            with span("stage.publish", dispatch_mode=get_dispatch_mode()):
+                post_result = dispatch_post_content(post_payload)
+        except StageError as e:
+            structured_logger.error(
+                "Posting blueprint failed",
+                status_code=e.status_code,
+                response=str(e),
+                dispatch_mode=get_dispatch_mode(),
+                request_payload=post_payload
+            )
+            publish_error = e
         except Exception as e:
             structured_logger.error(
                 "Posting blueprint request error",
                 error=str(e),
-                request_url=posting_url if 'posting_url' in locals() else None,
-                request_payload=post_payload if 'post_payload' in locals() else None
+                dispatch_mode=get_dispatch_mode(),
+                request_payload=post_payload
             )
+            publish_error = e
+        if publish_error is not None:
+            post_result = failed_post_result(publish_error)
+        # Only a successful publish is final; it is recorded at once, so a later failure
+        # (such as the save below) cannot make the retry publish the post a second time
+        if resumable and post_result.get("instagramPostId"):
+            checkpoints["publish"] = post_result
+            try:
+                post_repository.record_publish_result(post_id, post_result, checkpoint=True)
+            except Exception as e:
+                structured_logger.error("Failed to record publish checkpoint", error=str(e), post_id=post_id)
 
-        # Update post item in posts container with Instagram post id and status
-        try:
-            if instagram_post_id or post_status:
-                post_doc_update = posts_container.read_item(item=post_id, partition_key=post_id)
-                post_doc_update["instagramPostId"] = instagram_post_id
-                post_doc_update["postStatus"] = post_status
-                posts_container.replace_item(item=post_id, body=post_doc_update)
-        except Exception as e:
-            structured_logger.error("Failed to update post with Instagram info", error=str(e))
-
-        # Add Instagram post result to response
-        response_body = {"id": post_id, "content": content, "imageUrl": image_url}
-        if instagram_post_result:
-            response_body["instagramResult"] = instagram_post_result
-        if instagram_post_id:
-            response_body["instagramPostId"] = instagram_post_id
-        if post_status:
-            response_body["postStatus"] = post_status
-        if image_url_for_generation:
-            response_body["mediaSearchImageUrl"] = image_url_for_generation
+    # Write to Cosmos DB (posts container) once, with the Instagram post id and status included
+    post_doc = build_post_doc(
+        post_id, brand_id, template_id, content, image_url, post_result,
+        checkpoints=checkpoints if resumable else None
+    )
+    with span("stage.save_post"):
+        post_repository.save(post_doc)
+    structured_logger.info("Content written to Cosmos DB", post_id=post_id)
+    if resumable and publish and publish_failed_transiently(post_result, publish_error):
+        # The failed status is recorded above; the publish stage is retried on resume
+        raise resumable_stage_failure("publish", publish_error or post_result.get("instagramResult"))
 
-        # Use OrchestratorResponse for serialization
-        response_model = OrchestratorResponse(status="success", result=response_body)
-        return func.HttpResponse(response_model.model_dump_json(), status_code=201, mimetype="application/json")
-    except Exception as e:
-        structured_logger.error("Orchestrator error", error=str(e))
-        return func.HttpResponse(json.dumps({"error": str(e)}), status_code=500, mimetype="application/json")
+    # Add Instagram post result to response
+    return build_response_body(post_id, content, image_url, post_result, image_url_for_generation)
@@ -0,0 +1,81 @@
+import asyncio
+from azure.functions.decorators import Blueprint
+from azurefunctions.extensions.http.fastapi import JSONResponse, Request, StreamingResponse
+import os
+from blueprints.orchestrator_blueprint import CORRELATION_ID_HEADER, get_idempotency_key, timings_requested
+from blueprints.orchestrator_async_blueprint import run_idempotent_orchestration_async
+from shared.errors import StageError
+from shared.logger import structured_logger
+from shared.utils.stream_utils import NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, STREAM_HEADERS, format_ndjson, format_sse, wants_sse
+from generated_models.models import OrchestratorResponse
+
+orchestrator_stream_blueprint = Blueprint()
+
+# Marks the end of the pipeline on the event queue
+_DONE = object()
+
+
+@orchestrator_stream_blueprint.route(route="generate-content-orchestrator-stream", methods=["POST"])
+async def generate_content_orchestrator_stream(req: Request) -> StreamingResponse:
+    """
+    Streaming variant of generate-content-orchestrator. Emits a "text" event as
+    soon as the content is generated, then "image" and "post", and finally
+    "result" with the OrchestratorResponse (or "error"). Events are NDJSON lines,
+    or server-sent events with `?format=sse` / `Accept: text/event-stream`.
+    """
+    try:
+        data = await req.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid JSON in request body."}, status_code=400)
+    sse = wants_sse(req.query_params, req.headers)
+    events = stream_orchestration_events(
+        data, user_id=req.headers.get("X-API-Key", "anonymous"), idempotency_key=get_idempotency_key(req, data),
+        correlation_id=req.headers.get(CORRELATION_ID_HEADER), include_timings=timings_requested(req.query_params)
+    )
+    return StreamingResponse(
+        (format_sse(event) if sse else format_ndjson(event) async for event in events),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        headers=STREAM_HEADERS,
+    )
+
+
+def get_heartbeat_seconds() -> float:
+    """Idle interval after which a heartbeat event is sent (ORCHESTRATOR_STREAM_HEARTBEAT_SECONDS, default 15)."""
+    return float(os.environ.get("ORCHESTRATOR_STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+async def stream_orchestration_events(data: dict, user_id: str, idempotency_key=None, correlation_id=None, include_timings=False):
+    """
+    Runs the async pipeline and yields {"event", "data"} dicts as partial results
+    become available, with a heartbeat whenever nothing was sent for a while so
+    gateways do not drop the idle connection.
+    """
+    queue = asyncio.Queue()
+    heartbeat_seconds = get_heartbeat_seconds()
+    task = asyncio.ensure_future(run_idempotent_orchestration_async(
+        data, user_id=user_id, idempotency_key=idempotency_key,
+        correlation_id=correlation_id, include_timings=include_timings,
+        on_progress=lambda event, payload: queue.put_nowait({"event": event, "data": payload}),
+    ))
+    task.add_done_callback(lambda _: queue.put_nowait(_DONE))
+    # The pipeline is not cancelled if the client goes away: publishing must not stop halfway,
+    # and with an idempotency key the caller can fetch the stored result later
+    while True:
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+        except asyncio.TimeoutError:
+            yield {"event": "heartbeat"}
+            continue
+        if event is not _DONE:
+            yield event
+            continue
+        try:
+            response_body, replayed = task.result()
+            response_model = OrchestratorResponse(status="success", result=response_body)
+            yield {"event": "result", "data": {**response_model.model_dump(mode="json"), "replayed": replayed}}
+        except StageError as e:
+            yield {"event": "error", "data": {"error": str(e), "statusCode": e.status_code}}
+        except Exception as e:
+            structured_logger.error("Streaming orchestrator error", error=str(e))
+            yield {"event": "error", "data": {"error": str(e), "statusCode": 500}}
+        return
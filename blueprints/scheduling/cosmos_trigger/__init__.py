@@ -4,6 +4,8 @@ import json
 from datetime import datetime, timedelta
 from azure.storage.queue import QueueClient
 import pytz
+from blueprints.scheduling.pregeneration import enqueue_pregeneration
+from shared.utils.template_cache import invalidate_template
 
 def get_next_occurrence(day_of_week, hour, minute, timezone):
     from_zone = pytz.timezone(timezone)
@@ -26,6 +28,8 @@ def main(documents: func.DocumentList) -> None:
             try:
                 template_id = doc.get("id")
                 brand_id = doc.get("template_info", {}).get("brand_id") or doc.get("brand_id")
+                # Drop the cached copy so the next generation reads the changed template
+                invalidate_template(doc.get("templateInfo", {}).get("brandId") or brand_id, template_id)
                 schedule = doc.get("schedule", {})
                 days_of_week = schedule.get("days_of_week", [])
                 time_slots = schedule.get("time_slots", [])
@@ -46,8 +50,11 @@ def main(documents: func.DocumentList) -> None:
                         payload = {
                             "template_id": template_id,
                             "brand_id": brand_id,
-                            "schedule": schedule
+                            "schedule": schedule,
+                            "slotTime": next_run.isoformat()
                         }
                         queue_client.send_message(json.dumps(payload), visibility_timeout=delay_seconds)
+                        # Generate the draft ahead of the slot when pre-generation is enabled
+                        enqueue_pregeneration(queue_client, payload, delay_seconds)
             except Exception as e:
                 print(f"Error scheduling for doc: {e}")
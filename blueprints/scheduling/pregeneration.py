@@ -0,0 +1,60 @@
+"""
+pregeneration.py
+
+Pre-generation buffer for scheduled posts. With SCHEDULER_PREGENERATE_LEAD_MINUTES
+set, every scheduled slot gets a second queue message that becomes visible
+inside the lead window before the slot. Its run generates the text, searches
+media and renders the image into a draft post (see pregenerate_post), so the
+slot-time run resumes from those checkpoints and only publishes.
+
+Pre-generation times are spread at random between the start of the lead window
+and SCHEDULER_PREGENERATE_MARGIN_MINUTES (default 10) before the slot, so
+popular slot times do not all generate at the same moment and a failed
+pre-generation still has time to be retried.
+
+Functions:
+    - pregeneration_delay: Visibility delay of the pre-generation message for a slot.
+    - enqueue_pregeneration: Enqueue the pre-generation message for a slot.
+    - is_pregeneration: Whether a queue payload is a pre-generation message.
+"""
+
+import json
+import os
+import random
+
+# `mode` of a queue message that pre-generates a slot instead of publishing it
+PREGENERATE_MODE = "pregenerate"
+
+
+def _lead_seconds() -> int:
+    return int(float(os.environ.get("SCHEDULER_PREGENERATE_LEAD_MINUTES", "0")) * 60)
+
+
+def _margin_seconds() -> int:
+    return int(float(os.environ.get("SCHEDULER_PREGENERATE_MARGIN_MINUTES", "10")) * 60)
+
+
+def pregeneration_delay(slot_delay_seconds: int):
+    """
+    Seconds from now until the slot's pre-generation should run, or None when
+    pre-generation is disabled or the slot is too close to pre-generate.
+    """
+    lead = _lead_seconds()
+    if lead <= 0 or slot_delay_seconds <= _margin_seconds():
+        return None
+    earliest = max(0, slot_delay_seconds - lead)
+    latest = max(earliest, slot_delay_seconds - _margin_seconds())
+    return random.randint(earliest, latest)
+
+
+def enqueue_pregeneration(queue_client, payload: dict, slot_delay_seconds: int) -> bool:
+    """Enqueues a pre-generation message for the slot `payload` describes; returns False when none is due."""
+    delay = pregeneration_delay(slot_delay_seconds)
+    if delay is None:
+        return False
+    queue_client.send_message(json.dumps({**payload, "mode": PREGENERATE_MODE}), visibility_timeout=delay)
+    return True
+
+
+def is_pregeneration(payload: dict) -> bool:
+    return payload.get("mode") == PREGENERATE_MODE
@@ -4,7 +4,10 @@ import os
 from datetime import datetime, timedelta
 from azure.storage.queue import QueueClient
 import pytz
-from blueprints.orchestrator_blueprint import generate_content_orchestrator
+from blueprints.orchestrator_blueprint import generate_content_orchestrator, pregenerate_post, IDEMPOTENCY_KEY_HEADER, IDEMPOTENT_REPLAYED_HEADER
+from blueprints.scheduling.pregeneration import enqueue_pregeneration, is_pregeneration
+from shared.idempotency import scheduled_idempotency_key
+from shared.logger import structured_logger
 
 def get_next_occurrence(day_of_week, hour, minute, timezone):
     from_zone = pytz.timezone(timezone)
@@ -22,46 +25,93 @@ def get_next_occurrence(day_of_week, hour, minute, timezone):
     next_utc = next_local.astimezone(utc)
     return next_utc.replace(tzinfo=None)
 
+def is_last_delivery(msg: func.QueueMessage) -> bool:
+    """Whether this is the final delivery before the message goes to the poison queue (host.json queues.maxDequeueCount)."""
+    max_dequeue_count = int(os.environ.get("SCHEDULER_QUEUE_MAX_DEQUEUE_COUNT", "5"))
+    return (getattr(msg, "dequeue_count", None) or 1) >= max_dequeue_count
+
+def enqueue_next_runs(payload: dict, template_id, brand_id):
+    """Enqueues the next occurrence of every scheduled slot, with its pre-generation message."""
+    schedule = payload.get("schedule", {})
+    days_of_week = schedule.get("daysOfWeek", [])
+    time_slots = schedule.get("timeSlots", [])
+    for day in days_of_week:
+        for slot in time_slots:
+            hour = slot.get("hour", 8)
+            minute = slot.get("minute", 0)
+            timezone = slot.get("timezone", "UTC")
+            next_run = get_next_occurrence(day, hour, minute, timezone)
+            delay_seconds = int((next_run - datetime.utcnow()).total_seconds())
+            if delay_seconds < 0:
+                continue
+            queue_name = os.environ.get("SCHEDULER_QUEUE_NAME", "scheduled-content-queue")
+            queue_conn_str = os.environ["AzureWebJobsStorage"]
+            queue_client = QueueClient.from_connection_string(queue_conn_str, queue_name)
+            next_payload = {
+                "templateId": template_id,
+                "brandId": brand_id,
+                "schedule": schedule,
+                "slotTime": next_run.isoformat()
+            }
+            queue_client.send_message(json.dumps(next_payload), visibility_timeout=delay_seconds)
+            enqueue_pregeneration(queue_client, next_payload, delay_seconds)
+
 def main(msg: func.QueueMessage) -> None:
+    """
+    Runs a scheduled slot, then enqueues the slot's next occurrence. A run that fails
+    transiently (5xx/429) is raised so the queue redelivers the message and the retry
+    resumes from the run's checkpoints; the next occurrence is only enqueued once the
+    slot has completed, failed permanently, or is on its last delivery.
+    """
     try:
-        data = msg.get_body().decode('utf-8')
-        payload = json.loads(data)
-        class MockRequest:
-            def __init__(self, json_data):
-                self._json = json_data
-                self.headers = {}
-            def get_json(self):
-                return self._json
-        req = MockRequest({
-            "templateId": payload.get("templateId"),
-            "brandId": payload.get("brandId"),
-            "variableValues": payload.get("variableValues", {})
-        })
-        generate_content_orchestrator(req)
-
-        # --- Enqueue next scheduled run ---
-        schedule = payload.get("schedule", {})
-        template_id = payload.get("templateId")
-        brand_id = payload.get("brandId")
-        days_of_week = schedule.get("daysOfWeek", [])
-        time_slots = schedule.get("timeSlots", [])
-        for day in days_of_week:
-            for slot in time_slots:
-                hour = slot.get("hour", 8)
-                minute = slot.get("minute", 0)
-                timezone = slot.get("timezone", "UTC")
-                next_run = get_next_occurrence(day, hour, minute, timezone)
-                delay_seconds = int((next_run - datetime.utcnow()).total_seconds())
-                if delay_seconds < 0:
-                    continue
-                queue_name = os.environ.get("SCHEDULER_QUEUE_NAME", "scheduled-content-queue")
-                queue_conn_str = os.environ["AzureWebJobsStorage"]
-                queue_client = QueueClient.from_connection_string(queue_conn_str, queue_name)
-                next_payload = {
-                    "templateId": template_id,
-                    "brandId": brand_id,
-                    "schedule": schedule
-                }
-                queue_client.send_message(json.dumps(next_payload), visibility_timeout=delay_seconds)
+        _handle_message(msg)
     except Exception as e:
-        print(f"Error in queue trigger: {e}")
+        structured_logger.error("Error in queue trigger", error=str(e), message_id=msg.id)
+        raise
+
+def _handle_message(msg: func.QueueMessage) -> None:
+    data = msg.get_body().decode('utf-8')
+    payload = json.loads(data)
+    # The Cosmos trigger enqueues snake_case keys; runs re-enqueued below use camelCase
+    template_id = payload.get("templateId") or payload.get("template_id")
+    brand_id = payload.get("brandId") or payload.get("brand_id")
+    # Redeliveries of this message map to the same key, so the stored result is replayed
+    # instead of regenerating and re-posting
+    slot_time = payload.get("slotTime")
+    idempotency_key = scheduled_idempotency_key(template_id, brand_id, slot_time) if slot_time else f"queue:{msg.id}"
+    if is_pregeneration(payload):
+        # Draft for the slot's run (same key); a slot already due is generated and published at slot time.
+        # Failures propagate so the queue retries the pre-generation.
+        if slot_time and datetime.fromisoformat(slot_time) > datetime.utcnow():
+            pregenerate_post(template_id, brand_id, payload.get("variableValues", {}), idempotency_key)
+        return
+    class MockRequest:
+        def __init__(self, json_data, headers):
+            self._json = json_data
+            self.headers = headers
+            self.params = {}
+        def get_json(self):
+            return self._json
+    req = MockRequest({
+        "templateId": template_id,
+        "brandId": brand_id,
+        "variableValues": payload.get("variableValues", {})
+    }, {IDEMPOTENCY_KEY_HEADER: idempotency_key})
+    response = generate_content_orchestrator(req)
+    if response.headers.get(IDEMPOTENT_REPLAYED_HEADER) or response.status_code == 409:
+        # Another delivery of this slot completed (or is running) and enqueues the next run
+        return
+    if response.status_code >= 400:
+        transient = response.status_code >= 500 or response.status_code == 429
+        if transient and not is_last_delivery(msg):
+            raise RuntimeError(
+                f"Scheduled run failed with status {response.status_code}; "
+                "the queue redelivers the message to resume from its checkpoints"
+            )
+        structured_logger.error(
+            "Scheduled run failed permanently", status_code=response.status_code,
+            template_id=template_id, brand_id=brand_id, slot_time=slot_time
+        )
+
+    # --- Enqueue next scheduled run ---
+    enqueue_next_runs(payload, template_id, brand_id)
@@ -6,7 +6,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 
 from pydantic import BaseModel, Field, RootModel
 
@@ -400,3 +400,70 @@ class MediaDocument(BaseModel1):
 
 
 ContentGenerationTemplateGet = ContentGenerationTemplateDocument
+
+
+class AzureOpenAIGenerateContentRequest(BaseModel):
+    template: dict[str, Any] = Field(
+        ..., description='Template document whose settings.prompt_template drives the generation.'
+    )
+    variableValues: Optional[dict[str, Any]] = Field(
+        None, description='Values for the prompt template variables.'
+    )
+
+
+class AzureOpenAIGenerateContentResponse(BaseModel):
+    text: str = Field(..., description='Text for the post image.')
+    comment: str = Field(..., description='Caption posted with the image.')
+    hashtags: list[str]
+
+
+class OrchestratorRequest(BaseModel):
+    template_id: str = Field(..., alias='templateId')
+    brand_id: str = Field(..., alias='brandId')
+    variable_values: Optional[dict[str, Any]] = Field(None, alias='variableValues')
+
+
+class OrchestratorResponse(BaseModel):
+    status: str
+    result: Optional[dict[str, Any]] = None
+
+
+class PostingRequest(BaseModel):
+    brand_id: str = Field(..., alias='brandId')
+    image_url: Optional[str] = Field(None, alias='imageUrl')
+    content: Optional[dict[str, Any]] = None
+    post_id: Optional[str] = Field(None, alias='postId')
+
+
+class PostingResponse(BaseModel):
+    status: str
+    post_url: Optional[str] = None
+    error: Optional[Any] = None
+
+
+class Container(BaseModel):
+    width: Optional[int] = None
+    height: Optional[int] = None
+    padding: Optional[int] = None
+
+
+class Background(BaseModel):
+    type: Optional[str] = Field(None, description='"color" or "image".')
+    value: Optional[str] = Field(None, description='Hex color or image URL.')
+    filters: Optional[list[str]] = None
+
+
+class Format(BaseModel):
+    image_format: Optional[str] = Field(None, alias='imageFormat')
+
+
+class TextOverlay(BaseModel):
+    text: Optional[str] = None
+    visual_style: Optional[VisualStyle] = Field(None, alias='visualStyle')
+
+
+class ImageContent(BaseModel):
+    container: Optional[Container] = None
+    background: Optional[Background] = None
+    format: Optional[Format] = None
+    text_overlay: Optional[TextOverlay] = Field(None, alias='textOverlay')
@@ -0,0 +1,13 @@
+"""Exceptions shared by blueprint logic and the orchestrator."""
+
+
+class StageError(Exception):
+    """
+    Raised by a pipeline stage's logic function when it cannot produce a result.
+    Carries the HTTP status code the stage's route would have responded with, so
+    the thin HTTP wrappers and in-process callers surface the same failure.
+    """
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
@@ -0,0 +1,224 @@
+"""
+idempotency.py
+
+Persistent idempotency store for orchestrator runs. A request carrying an
+idempotency key first claims the key in the idempotency container; a repeat of
+a completed request gets the stored OrchestratorResponse result back instead of
+regenerating text, re-rendering and re-posting.
+
+Documents live in COSMOS_DB_CONTAINER_IDEMPOTENCY (default "idempotency",
+partition key /id) and expire through the Cosmos `ttl` field after
+IDEMPOTENCY_TTL_SECONDS (default 7 days). A claim whose run died without
+completing can be taken over after IDEMPOTENCY_LEASE_SECONDS (default 900).
+"""
+
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+from shared.errors import StageError
+from shared.logger import structured_logger
+from shared.utils.cosmos_utils import get_async_container, get_container
+
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+
+# Namespace for deriving stable post ids from idempotency keys
+_POST_ID_NAMESPACE = uuid.UUID("8f1e4c1e-5b0a-4a57-9f43-6a0e7c2b1d55")
+
+
+def _container_name():
+    return os.environ.get("COSMOS_DB_CONTAINER_IDEMPOTENCY", "idempotency")
+
+
+def _lease_seconds():
+    return float(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "900"))
+
+
+def _ttl_seconds():
+    return int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def _doc_id(key: str) -> str:
+    # Keys may contain characters Cosmos does not allow in ids ('/', '?', '#', ...)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def post_id_for_key(key: str) -> str:
+    """Stable post id for an idempotency key, so a retried run writes the same post document."""
+    return str(uuid.uuid5(_POST_ID_NAMESPACE, key))
+
+
+def scheduled_idempotency_key(template_id, brand_id, slot_time) -> str:
+    """Key for a scheduled run: one generation per template, brand and slot."""
+    return f"scheduled:{template_id}:{brand_id}:{slot_time}"
+
+
+def _claim_doc(key: str) -> dict:
+    return {
+        "id": _doc_id(key),
+        "key": key,
+        "status": STATUS_IN_PROGRESS,
+        "claimedAt": time.time(),
+        "ttl": _ttl_seconds(),
+    }
+
+
+def _completed_doc(key: str, response: dict) -> dict:
+    return {
+        "id": _doc_id(key),
+        "key": key,
+        "status": STATUS_COMPLETED,
+        "response": response,
+        "completedAt": datetime.utcnow().isoformat(),
+        "ttl": _ttl_seconds(),
+    }
+
+
+def _in_progress_error():
+    return StageError("A request with this idempotency key is already in progress.", 409)
+
+
+def _stale(doc: dict) -> bool:
+    return time.time() - float(doc.get("claimedAt") or 0) > _lease_seconds()
+
+
+class IdempotencyStore:
+    """Idempotency claims and stored results over a sync Cosmos container."""
+
+    def __init__(self, container=None):
+        self.container = container or get_container(_container_name())
+
+    def begin(self, key: str):
+        """
+        Claims `key` for a new run. Returns the stored response if the key already
+        completed, None if the caller now owns the run. Raises StageError(409)
+        while another run holds a live claim.
+        """
+        doc_id = _doc_id(key)
+        for _ in range(2):
+            try:
+                self.container.create_item(_claim_doc(key))
+                return None
+            except CosmosResourceExistsError:
+                pass
+            try:
+                existing = self.container.read_item(item=doc_id, partition_key=doc_id)
+            except CosmosResourceNotFoundError:
+                continue  # Claim was released between create and read; try again
+            if existing.get("status") == STATUS_COMPLETED:
+                return existing.get("response")
+            if not _stale(existing):
+                raise _in_progress_error()
+            try:
+                self.container.replace_item(
+                    item=doc_id, body=_claim_doc(key),
+                    etag=existing["_etag"], match_condition=MatchConditions.IfNotModified
+                )
+                structured_logger.warning("Took over stale idempotency claim", idempotency_key=key)
+                return None
+            except CosmosAccessConditionFailedError:
+                raise _in_progress_error()
+        raise _in_progress_error()
+
+    def complete(self, key: str, response: dict):
+        self.container.upsert_item(_completed_doc(key, response))
+
+    def abandon(self, key: str):
+        """Releases the claim after a failed run so a retry can start over."""
+        doc_id = _doc_id(key)
+        try:
+            self.container.delete_item(item=doc_id, partition_key=doc_id)
+        except Exception as e:
+            structured_logger.error("Failed to release idempotency claim", error=str(e), idempotency_key=key)
+
+
+class AsyncIdempotencyStore:
+    """Idempotency claims and stored results over an azure.cosmos.aio container."""
+
+    def __init__(self, container=None):
+        self.container = container or get_async_container(_container_name())
+
+    async def begin(self, key: str):
+        doc_id = _doc_id(key)
+        for _ in range(2):
+            try:
+                await self.container.create_item(_claim_doc(key))
+                return None
+            except CosmosResourceExistsError:
+                pass
+            try:
+                existing = await self.container.read_item(item=doc_id, partition_key=doc_id)
+            except CosmosResourceNotFoundError:
+                continue
+            if existing.get("status") == STATUS_COMPLETED:
+                return existing.get("response")
+            if not _stale(existing):
+                raise _in_progress_error()
+            try:
+                await self.container.replace_item(
+                    item=doc_id, body=_claim_doc(key),
+                    etag=existing["_etag"], match_condition=MatchConditions.IfNotModified
+                )
+                structured_logger.warning("Took over stale idempotency claim", idempotency_key=key)
+                return None
+            except CosmosAccessConditionFailedError:
+                raise _in_progress_error()
+        raise _in_progress_error()
+
+    async def complete(self, key: str, response: dict):
+        await self.container.upsert_item(_completed_doc(key, response))
+
+    async def abandon(self, key: str):
+        doc_id = _doc_id(key)
+        try:
+            await self.container.delete_item(item=doc_id, partition_key=doc_id)
+        except Exception as e:
+            structured_logger.error("Failed to release idempotency claim", error=str(e), idempotency_key=key)
+
+
+def run_idempotent(key, compute):
+    """
+    Runs `compute()` once per idempotency key. Returns (response, replayed);
+    `replayed` is True when the stored response of an earlier run was returned.
+    Without a key, `compute()` always runs.
+    """
+    if not key:
+        return compute(), False
+    store = IdempotencyStore()
+    stored = store.begin(key)
+    if stored is not None:
+        return stored, True
+    try:
+        response = compute()
+    except BaseException:
+        store.abandon(key)
+        raise
+    store.complete(key, response)
+    return response, False
+
+
+async def run_idempotent_async(key, compute):
+    """Async variant of run_idempotent; `compute` is a coroutine function."""
+    if not key:
+        return await compute(), False
+    store = AsyncIdempotencyStore()
+    stored = await store.begin(key)
+    if stored is not None:
+        return stored, True
+    try:
+        response = await compute()
+    except BaseException:
+        await store.abandon(key)
+        raise
+    await store.complete(key, response)
+    return response, False
@@ -0,0 +1,109 @@
+"""
+pipeline.py
+
+A minimal asyncio stage graph. Each Stage names the stages it depends on; a
+stage starts as soon as all of its dependencies have finished, so independent
+stages overlap and total latency approaches the critical path of the graph.
+
+shared_lookup lets several concurrent pipeline runs share one in-flight lookup
+(for example a template or brand read) instead of each issuing its own.
+
+Usage Example:
+    results = await run_stage_graph([
+        Stage("template", load_template),
+        Stage("brand", load_brand),
+        Stage("text", generate_text, depends_on=("template",)),
+        Stage("publish", publish, depends_on=("text", "brand")),
+    ])
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from shared.tracing import span
+
+
+@dataclass
+class Stage:
+    """
+    A named unit of pipeline work. `func` is awaited with the dict of results
+    produced so far (keyed by stage name) once every stage in `depends_on` has completed.
+    """
+    name: str
+    func: Callable[[Dict[str, Any]], Awaitable[Any]]
+    depends_on: Tuple[str, ...] = field(default_factory=tuple)
+
+
+def _validate(stages):
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError("Stage names must be unique")
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.depends_on:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+    # Reject cycles up front; they would otherwise deadlock the graph
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage graph has a cycle through '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+
+
+async def run_stage_graph(stages, results=None) -> Dict[str, Any]:
+    """
+    Run `stages` concurrently, respecting their dependencies.
+    Returns the results dict keyed by stage name. If any stage raises, the
+    remaining stages are cancelled and the first exception is re-raised.
+    Each stage is recorded as a "stage.<name>" span on the current run trace.
+    `results` may be pre-seeded with values that stages can read.
+    """
+    _validate(stages)
+    results = results if results is not None else {}
+    tasks = {}
+
+    async def run(stage):
+        if stage.depends_on:
+            await asyncio.gather(*(tasks[dep] for dep in stage.depends_on))
+        with span(f"stage.{stage.name}"):
+            results[stage.name] = await stage.func(results)
+        return results[stage.name]
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return results
+
+
+async def shared_lookup(memo, key, factory):
+    """
+    Await `factory()` at most once per `key` among all callers sharing `memo`,
+    so concurrent pipeline runs (e.g. one batch) reuse a single in-flight lookup.
+    With `memo` None the factory is simply awaited.
+    """
+    if memo is None:
+        return await factory()
+    task = memo.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        memo[key] = task
+    # Shield so one cancelled caller does not cancel the lookup for the others
+    return await asyncio.shield(task)
@@ -0,0 +1,123 @@
+"""
+post_repository.py
+
+Persistence for post documents in the posts container (partition key /id).
+
+Posts are written once when every field is known (save), or saved early and
+then updated with a partial-document patch (record_publish_result). Patches are
+conditional on the ETag returned by the save, so a concurrent writer causes a
+412 instead of a silent lost update, and no read is needed before the update.
+
+Resumable runs also keep each pipeline stage's output under the document's
+`checkpoints` object (text, media, image, publish) so a retry can skip the
+stages that already completed. record_checkpoint requires the document to
+exist with a `checkpoints` object.
+"""
+
+import os
+from datetime import datetime
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+from shared.utils.cosmos_utils import get_async_container, get_container
+
+
+def _updated_date_operation() -> dict:
+    return {"op": "set", "path": "/metadata/updatedDate", "value": datetime.utcnow().isoformat()}
+
+
+def _publish_patch_operations(post_result: dict, checkpoint=False) -> list:
+    operations = [
+        {"op": "set", "path": "/instagramPostId", "value": post_result.get("instagramPostId")},
+        {"op": "set", "path": "/postStatus", "value": post_result.get("postStatus")},
+        _updated_date_operation(),
+    ]
+    if checkpoint:
+        operations.append({"op": "set", "path": "/checkpoints/publish", "value": post_result})
+    return operations
+
+
+def _checkpoint_patch_operations(stage: str, value, fields=None) -> list:
+    operations = [{"op": "set", "path": f"/checkpoints/{stage}", "value": value}]
+    for name, field_value in (fields or {}).items():
+        operations.append({"op": "set", "path": f"/{name}", "value": field_value})
+    operations.append(_updated_date_operation())
+    return operations
+
+
+def _match_kwargs(etag):
+    if not etag:
+        return {}
+    return {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+
+
+class PostRepository:
+    """Post persistence over a sync Cosmos container."""
+
+    def __init__(self, container=None):
+        self.container = container or get_container(os.environ["COSMOS_DB_CONTAINER_POSTS"])
+
+    def save(self, post_doc: dict) -> dict:
+        """Writes the post document in a single upsert; the returned document carries the `_etag` for later patches."""
+        return self.container.upsert_item(post_doc)
+
+    def record_publish_result(self, post_id: str, post_result: dict, etag=None, checkpoint=False) -> dict:
+        """
+        Patches instagramPostId/postStatus onto an existing post, conditional on `etag` when given.
+        With `checkpoint`, the result is also stored as the publish stage checkpoint.
+        """
+        return self.container.patch_item(
+            item=post_id,
+            partition_key=post_id,
+            patch_operations=_publish_patch_operations(post_result, checkpoint),
+            **_match_kwargs(etag)
+        )
+
+    def load_checkpoints(self, post_id: str) -> dict:
+        """Returns the stage checkpoints of an earlier attempt at this post, or {} if there was none."""
+        try:
+            post_doc = self.container.read_item(item=post_id, partition_key=post_id)
+        except CosmosResourceNotFoundError:
+            return {}
+        return post_doc.get("checkpoints") or {}
+
+    def record_checkpoint(self, post_id: str, stage: str, value, fields=None) -> dict:
+        """Stores a stage's output under checkpoints and sets any mirrored top-level `fields`."""
+        return self.container.patch_item(
+            item=post_id,
+            partition_key=post_id,
+            patch_operations=_checkpoint_patch_operations(stage, value, fields)
+        )
+
+
+class AsyncPostRepository:
+    """Post persistence over an azure.cosmos.aio container."""
+
+    def __init__(self, container=None):
+        self.container = container or get_async_container(os.environ["COSMOS_DB_CONTAINER_POSTS"])
+
+    async def save(self, post_doc: dict) -> dict:
+        return await self.container.upsert_item(post_doc)
+
+    async def record_publish_result(self, post_id: str, post_result: dict, etag=None, checkpoint=False) -> dict:
+        return await self.container.patch_item(
+            item=post_id,
+            partition_key=post_id,
+            patch_operations=_publish_patch_operations(post_result, checkpoint),
+            **_match_kwargs(etag)
+        )
+
+    async def load_checkpoints(self, post_id: str) -> dict:
+        try:
+            post_doc = await self.container.read_item(item=post_id, partition_key=post_id)
+        except CosmosResourceNotFoundError:
+            return {}
+        return post_doc.get("checkpoints") or {}
+
+    async def record_checkpoint(self, post_id: str, stage: str, value, fields=None) -> dict:
+        return await self.container.patch_item(
+            item=post_id,
+            partition_key=post_id,
+            patch_operations=_checkpoint_patch_operations(stage, value, fields)
+        )
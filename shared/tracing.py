@@ -0,0 +1,135 @@
+"""
+tracing.py
+
+Lightweight per-run span timing. A RunTrace collects one span per pipeline
+stage or downstream call (Cosmos, OpenAI, media search, rendering, blob upload,
+Graph API) with its start offset, duration, status and key attributes, and logs
+them as a single structured summary line when the run finishes.
+
+The active trace is held in a context variable, so code called from the
+orchestrator (including worker threads started with asyncio.to_thread and tasks
+of the stage graph) records into the run's trace through `span` without it being
+passed around. Outside a run, `span` does nothing.
+
+Usage Example:
+    with start_trace("orchestrator", template_id=template_id) as trace:
+        with span("template.read", template_id=template_id):
+            ...
+    trace.timings()  # {"totalMs": ..., "spans": [...]}
+"""
+
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from shared.logger import structured_logger
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class RunTrace:
+    """Spans recorded during one orchestrator run, under one correlation id."""
+
+    def __init__(self, name: str, correlation_id=None, **attributes):
+        self.name = name
+        self.correlation_id = correlation_id or str(uuid.uuid4())
+        self.attributes = attributes
+        self.spans = []
+        self.status = "ok"
+        self._start = time.perf_counter()
+        self._end = None
+        self._lock = threading.Lock()  # Spans may finish on worker threads
+
+    def _elapsed_ms(self, at=None) -> float:
+        return round(((at if at is not None else time.perf_counter()) - self._start) * 1000, 2)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Times the enclosed block; attributes may be added to the yielded dict while it runs."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as e:
+            status = "error"
+            attributes.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            end = time.perf_counter()
+            record = {
+                "name": name,
+                "startMs": self._elapsed_ms(start),
+                "durationMs": round((end - start) * 1000, 2),
+                "status": status,
+            }
+            if attributes:
+                record["attributes"] = attributes
+            with self._lock:
+                self.spans.append(record)
+
+    def finish(self, status="ok"):
+        if self._end is None:
+            self._end = time.perf_counter()
+            self.status = status
+
+    def timings(self) -> dict:
+        """The `timings` object returned to callers: total duration and spans ordered by start."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["startMs"])
+        return {"correlationId": self.correlation_id, "totalMs": self._elapsed_ms(self._end), "spans": spans}
+
+    def log_summary(self):
+        """Emits the one structured summary line for the run."""
+        timings = self.timings()
+        structured_logger.info(
+            "Run timings",
+            correlation_id=self.correlation_id,
+            run=self.name,
+            status=self.status,
+            total_ms=timings["totalMs"],
+            span_ms={s["name"]: s["durationMs"] for s in timings["spans"]},
+            spans=timings["spans"],
+            **self.attributes
+        )
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str, correlation_id=None, **attributes):
+    """
+    Makes a new RunTrace current for the enclosed block and logs its summary on exit.
+    A trace already active in this context is reused, so nested runs (e.g. a
+    replayed idempotent call) add to the caller's trace instead of starting a second one.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+    trace = RunTrace(name, correlation_id, **attributes)
+    token = _current_trace.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish(status)
+        trace.log_summary()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Records a span on the current run's trace; a no-op outside a traced run."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(name, **attributes) as span_attributes:
+        yield span_attributes
@@ -1,13 +1,23 @@
 from azure.storage.blob import BlobServiceClient
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
 from urllib.parse import urlparse, unquote
+import asyncio
 import io
+import threading
+import weakref
+
+# Sync clients keep their connection pool for the worker's lifetime: conn_str -> client
+_blob_clients = {}
+_lock = threading.Lock()
+# aio clients are bound to the event loop that created them: event loop -> {conn_str: client}
+_async_blob_clients = weakref.WeakKeyDictionary()
 
 def download_blob_to_bytes(blob_url, conn_str):
     parsed = urlparse(blob_url)
     path_parts = parsed.path.lstrip('/').split('/', 1)
     blob_container = path_parts[0]
     blob = unquote(path_parts[1])
-    blob_service_client = BlobServiceClient.from_connection_string(conn_str)
+    blob_service_client = get_blob_service_client(conn_str)
     blob_client = blob_service_client.get_blob_client(container=blob_container, blob=blob)
     font_bytes = io.BytesIO()
     download_stream = blob_client.download_blob()
@@ -19,10 +29,35 @@ def upload_bytes_to_blob(blob_bytes, blob_name, container_name, conn_str, conten
     """
     Uploads bytes to Azure Blob Storage and returns the public URL.
     """
-    blob_service_client = BlobServiceClient.from_connection_string(conn_str)
+    blob_service_client = get_blob_service_client(conn_str)
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
     blob_client.upload_blob(blob_bytes, overwrite=True, content_type=content_type)
     # Build public URL
     account_name = blob_service_client.account_name
     url = f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_name}"
     return url
+
+def get_blob_service_client(conn_str):
+    """
+    Returns the process-wide BlobServiceClient for `conn_str`, so uploads and downloads reuse its keep-alive connections.
+    """
+    client = _blob_clients.get(conn_str)
+    if client is None:
+        with _lock:
+            client = _blob_clients.get(conn_str)
+            if client is None:
+                client = BlobServiceClient.from_connection_string(conn_str)
+                _blob_clients[conn_str] = client
+    return client
+
+def get_async_blob_service_client(conn_str):
+    """
+    Returns an aio BlobServiceClient for `conn_str`, reused for the lifetime of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_blob_clients.setdefault(loop, {})
+    client = clients.get(conn_str)
+    if client is None:
+        client = AsyncBlobServiceClient.from_connection_string(conn_str)
+        clients[conn_str] = client
+    return client
@@ -0,0 +1,106 @@
+"""
+cosmos_utils.py
+
+Process-wide Cosmos DB access layer. A single CosmosClient is created lazily per
+connection string and reused for the lifetime of the worker process, and
+container handles are cached by (connection string, database, container) so
+blueprints never pay client construction or metadata lookups per request.
+
+Async (azure.cosmos.aio) clients are bound to the event loop that created them,
+so they are pooled per (event loop, connection string) instead.
+
+Functions:
+    - get_cosmos_client: Return the pooled CosmosClient for a connection string.
+    - get_container: Return a cached container client by name.
+    - get_async_cosmos_client: Return the pooled aio CosmosClient for the running loop.
+    - get_async_container: Return a cached aio container client by name.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+
+from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+_clients = {}
+_containers = {}
+_async_pools = weakref.WeakKeyDictionary()  # event loop -> {key: client or container}
+_lock = threading.Lock()
+
+
+def get_cosmos_client(conn_str=None):
+    """
+    Return the process-wide CosmosClient for `conn_str`, creating it on first use.
+    Defaults to the COSMOS_DB_CONNECTION_STRING environment variable.
+    """
+    conn_str = conn_str or os.environ["COSMOS_DB_CONNECTION_STRING"]
+    client = _clients.get(conn_str)
+    if client is None:
+        with _lock:
+            client = _clients.get(conn_str)
+            if client is None:
+                client = CosmosClient.from_connection_string(conn_str)
+                _clients[conn_str] = client
+    return client
+
+
+def get_container(container_name, db_name=None, conn_str=None):
+    """
+    Return a cached ContainerProxy for `container_name`.
+    Defaults to the COSMOS_DB_NAME and COSMOS_DB_CONNECTION_STRING environment variables.
+    """
+    conn_str = conn_str or os.environ["COSMOS_DB_CONNECTION_STRING"]
+    db_name = db_name or os.environ["COSMOS_DB_NAME"]
+    key = (conn_str, db_name, container_name)
+    container = _containers.get(key)
+    if container is None:
+        client = get_cosmos_client(conn_str)
+        with _lock:
+            container = _containers.get(key)
+            if container is None:
+                container = client.get_database_client(db_name).get_container_client(container_name)
+                _containers[key] = container
+    return container
+
+
+def _async_pool():
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        with _lock:
+            pool = _async_pools.setdefault(loop, {})
+    return pool
+
+
+def get_async_cosmos_client(conn_str=None):
+    """
+    Return the aio CosmosClient for `conn_str` bound to the running event loop,
+    creating it on first use. Must be called from within a coroutine.
+    """
+    conn_str = conn_str or os.environ["COSMOS_DB_CONNECTION_STRING"]
+    pool = _async_pool()
+    key = ("client", conn_str)
+    client = pool.get(key)
+    if client is None:
+        client = AsyncCosmosClient.from_connection_string(conn_str)
+        pool[key] = client
+    return client
+
+
+def get_async_container(container_name, db_name=None, conn_str=None):
+    """
+    Return a cached aio ContainerProxy for `container_name` on the running event loop.
+    Defaults to the COSMOS_DB_NAME and COSMOS_DB_CONNECTION_STRING environment variables.
+    """
+    conn_str = conn_str or os.environ["COSMOS_DB_CONNECTION_STRING"]
+    db_name = db_name or os.environ["COSMOS_DB_NAME"]
+    pool = _async_pool()
+    key = ("container", conn_str, db_name, container_name)
+    container = pool.get(key)
+    if container is None:
+        client = get_async_cosmos_client(conn_str)
+        container = client.get_database_client(db_name).get_container_client(container_name)
+        pool[key] = container
+    return container
@@ -0,0 +1,339 @@
+"""
+deployment_pool.py
+
+Routes chat completions across several Azure OpenAI deployments (regions or
+models) so throughput is not capped by one deployment's quota.
+
+The pool is configured with AZURE_OPENAI_DEPLOYMENTS, a JSON list such as:
+
+    [{"name": "eastus", "endpoint": "https://east.openai.azure.com", "apiKey": "...",
+      "apiVersion": "2024-06-01", "deployment": "gpt-4o", "weight": 2, "tpm": 150000, "rpm": 900},
+     {"name": "swedencentral", "endpoint": "...", "apiKey": "...", "deployment": "gpt-4o", "weight": 1}]
+
+apiKey/apiVersion default to AZURE_OPENAI_API_KEY/AZURE_OPENAI_API_VERSION,
+and tpm/rpm to AZURE_OPENAI_TPM_LIMIT/AZURE_OPENAI_RPM_LIMIT. Without the
+setting the pool holds the single AZURE_OPENAI_* deployment.
+
+Each request goes to a healthy deployment picked at random by weight. A
+throttled deployment is taken out of rotation for its Retry-After interval and
+a failing one for an exponentially growing cooldown, and the request fails
+over to the next deployment. With AZURE_OPENAI_HEDGE=true, a request still
+running after the deployment's latency percentile (AZURE_OPENAI_HEDGE_PERCENTILE,
+default 95, once 20 latencies are known) is also sent to a second deployment
+and the first answer wins. Hedged attempts run on a shared pool of
+AZURE_OPENAI_HEDGE_MAX_WORKERS threads (default 32). The delay, like the
+latency samples it is taken from, counts from when the request leaves the
+rate limiter, so time spent queued for a worker or for quota never triggers
+a hedge.
+
+Functions:
+    - get_deployment_pool: Return the process-wide pool.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import openai
+
+from shared.errors import StageError
+from shared.logger import structured_logger
+from shared.tracing import span
+from shared.utils.openai_utils import (
+    create_chat_completion,
+    create_chat_completion_async,
+    get_async_openai_client,
+    get_openai_client,
+    get_openai_settings,
+)
+from shared.utils.rate_limiter import get_rate_limiter
+
+_MIN_LATENCY_SAMPLES = 20
+_MAX_COOLDOWN_SECONDS = 60.0
+
+_pool = None
+_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("AZURE_OPENAI_HEDGE_MAX_WORKERS", "32")), thread_name_prefix="openai-hedge"
+)
+
+
+@dataclass
+class Deployment:
+    """One Azure OpenAI deployment and its health."""
+    name: str
+    endpoint: str
+    api_key: str
+    api_version: str
+    deployment: str
+    weight: float = 1.0
+    tpm: int = None
+    rpm: int = None
+    cooldown_until: float = 0.0
+    consecutive_failures: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=200))
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def latency_percentile(self, percentile: float):
+        """Observed latency at `percentile` in seconds, or None until enough calls have completed."""
+        samples = sorted(self.latencies)
+        if len(samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def client(self):
+        return get_openai_client(self.endpoint, self.api_key, self.api_version, self.deployment)
+
+    def async_client(self):
+        return get_async_openai_client(self.endpoint, self.api_key, self.api_version, self.deployment)
+
+    def limiter(self):
+        return get_rate_limiter(self.name, self.tpm, self.rpm)
+
+    def request(self, chat_request: dict) -> dict:
+        return {**chat_request, "model": self.deployment}
+
+
+def _retry_after(error) -> float:
+    """Seconds from the retry-after-ms or Retry-After header of a throttled call; 10 when neither is usable."""
+    cause = error.__cause__ if isinstance(error, StageError) else error
+    response = getattr(cause, "response", None)
+    headers = response.headers if response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return 10.0
+
+
+def _throttled(error) -> bool:
+    return isinstance(error, openai.RateLimitError) or (isinstance(error, StageError) and error.status_code == 429)
+
+
+def _fails_over(error) -> bool:
+    """Throttling, 5xx and connection errors move to another deployment; request errors (4xx) would fail anywhere."""
+    return _throttled(error) or isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+class DeploymentPool:
+    """Weighted, health-aware routing with failover and optional hedging across deployments."""
+
+    def __init__(self, deployments, hedge=False, hedge_percentile=95.0):
+        self.deployments = deployments
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self._lock = threading.Lock()
+
+    @property
+    def default_deployment(self) -> str:
+        """Deployment name of the first configured deployment, for requests that need a model name up front."""
+        return self.deployments[0].deployment
+
+    def choose(self, exclude=()):
+        """Picks a healthy deployment by weight; if all are cooling down, the one that recovers first."""
+        now = time.monotonic()
+        candidates = [d for d in self.deployments if d not in exclude]
+        if not candidates:
+            return None
+        healthy = [d for d in candidates if d.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda d: d.cooldown_until)
+        return random.choices(healthy, weights=[d.weight for d in healthy])[0]
+
+    def mark_success(self, deployment, latency=None):
+        """Resets the failure count; `latency` (None for streams, which return at the headers) feeds the hedge delay."""
+        with self._lock:
+            deployment.consecutive_failures = 0
+            if latency is not None:
+                deployment.latencies.append(latency)
+
+    def mark_failure(self, deployment, error):
+        with self._lock:
+            deployment.consecutive_failures += 1
+            if _throttled(error):
+                cooldown = _retry_after(error)
+            else:
+                cooldown = min(_MAX_COOLDOWN_SECONDS, 2.0 ** deployment.consecutive_failures)
+            deployment.cooldown_until = max(deployment.cooldown_until, time.monotonic() + cooldown)
+        structured_logger.warning(
+            "Azure OpenAI deployment failed over", deployment=deployment.name, error=str(error), cooldown_seconds=cooldown
+        )
+
+    def _hedge_delay(self, deployment):
+        if not self.hedge or len(self.deployments) < 2:
+            return None
+        return deployment.latency_percentile(self.hedge_percentile)
+
+    def _latency(self, chat_request, sent_at):
+        """Seconds since the request was last sent (excluding rate-limiter waits); None for streams."""
+        return None if chat_request.get("stream") else time.monotonic() - sent_at[-1]
+
+    def _attempt(self, deployment, chat_request, last, hedged=False, sent=None):
+        """Runs one attempt on `deployment`; `sent` (a threading.Event), if given, is set once the request is sent."""
+        sent_at = []
+
+        def on_send():
+            sent_at.append(time.monotonic())
+            if sent is not None:
+                sent.set()
+
+        with span("openai.deployment", deployment=deployment.name, hedged=hedged):
+            try:
+                # The last candidate keeps the per-call retries; others fail over immediately
+                response = create_chat_completion(
+                    deployment.request(chat_request), deployment.client(), deployment.limiter(),
+                    max_retries=None if last else 0, on_send=on_send
+                )
+            except (openai.OpenAIError, StageError) as e:
+                if _fails_over(e):
+                    self.mark_failure(deployment, e)
+                raise
+        self.mark_success(deployment, self._latency(chat_request, sent_at))
+        return response
+
+    def complete(self, chat_request: dict):
+        """Runs `chat_request` on the pool, failing over across deployments until one succeeds."""
+        tried = []
+        while True:
+            deployment = self.choose(exclude=tried)
+            tried.append(deployment)
+            last = len(tried) == len(self.deployments)
+            try:
+                hedge_delay = self._hedge_delay(deployment)
+                backup = self.choose(exclude=tried) if hedge_delay is not None else None
+                if backup is None:
+                    return self._attempt(deployment, chat_request, last)
+                return self._hedged(deployment, backup, chat_request, hedge_delay)
+            except (openai.OpenAIError, StageError) as e:
+                if last or not _fails_over(e):
+                    raise
+
+    def _hedged(self, primary, backup, chat_request, delay):
+        sent = threading.Event()
+        futures = [_hedge_executor.submit(contextvars.copy_context().run, self._attempt, primary, chat_request, False, False, sent)]
+        futures[0].add_done_callback(lambda future: sent.set())
+        # The delay starts once the primary is sent, not while it waits for a worker or the rate limiter
+        sent.wait()
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            futures.append(_hedge_executor.submit(contextvars.copy_context().run, self._attempt, backup, chat_request, False, True))
+        errors = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()  # Dropped if still queued; a request already sent finishes in the background
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    async def _attempt_async(self, deployment, chat_request, last, hedged=False, sent=None):
+        """Async variant of _attempt; `sent` is an asyncio.Event."""
+        sent_at = []
+
+        def on_send():
+            sent_at.append(time.monotonic())
+            if sent is not None:
+                sent.set()
+
+        with span("openai.deployment", deployment=deployment.name, hedged=hedged):
+            try:
+                response = await create_chat_completion_async(
+                    deployment.request(chat_request), deployment.async_client(), deployment.limiter(),
+                    max_retries=None if last else 0, on_send=on_send
+                )
+            except (openai.OpenAIError, StageError) as e:
+                if _fails_over(e):
+                    self.mark_failure(deployment, e)
+                raise
+        self.mark_success(deployment, self._latency(chat_request, sent_at))
+        return response
+
+    async def complete_async(self, chat_request: dict):
+        """Async variant of complete; a hedged request cancels the slower attempt."""
+        tried = []
+        while True:
+            deployment = self.choose(exclude=tried)
+            tried.append(deployment)
+            last = len(tried) == len(self.deployments)
+            try:
+                hedge_delay = self._hedge_delay(deployment)
+                backup = self.choose(exclude=tried) if hedge_delay is not None else None
+                if backup is None:
+                    return await self._attempt_async(deployment, chat_request, last)
+                return await self._hedged_async(deployment, backup, chat_request, hedge_delay)
+            except (openai.OpenAIError, StageError) as e:
+                if last or not _fails_over(e):
+                    raise
+
+    async def _hedged_async(self, primary, backup, chat_request, delay):
+        sent = asyncio.Event()
+        tasks = [asyncio.ensure_future(self._attempt_async(primary, chat_request, False, False, sent))]
+        tasks[0].add_done_callback(lambda task: sent.set())
+        # The delay starts once the primary is sent, not while it waits for the rate limiter
+        await sent.wait()
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.append(asyncio.ensure_future(self._attempt_async(backup, chat_request, False, True)))
+        errors = []
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _load_deployments():
+    settings = get_openai_settings()
+    config = os.environ.get("AZURE_OPENAI_DEPLOYMENTS")
+    if not config:
+        return [Deployment(
+            name=settings["deployment"], endpoint=settings["endpoint"], api_key=settings["api_key"],
+            api_version=settings["api_version"], deployment=settings["deployment"]
+        )]
+    return [
+        Deployment(
+            name=entry.get("name") or entry["deployment"],
+            endpoint=entry["endpoint"],
+            api_key=entry.get("apiKey") or settings["api_key"],
+            api_version=entry.get("apiVersion") or settings["api_version"],
+            deployment=entry["deployment"],
+            weight=float(entry.get("weight", 1)),
+            tpm=entry.get("tpm"),
+            rpm=entry.get("rpm"),
+        )
+        for entry in json.loads(config)
+    ]
+
+
+def get_deployment_pool() -> DeploymentPool:
+    """Return the process-wide deployment pool, built from the environment on first use."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = DeploymentPool(
+                    _load_deployments(),
+                    hedge=os.environ.get("AZURE_OPENAI_HEDGE", "false").lower() in ("1", "true", "yes"),
+                    hedge_percentile=float(os.environ.get("AZURE_OPENAI_HEDGE_PERCENTILE", "95")),
+                )
+    return _pool
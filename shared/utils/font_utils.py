@@ -1,8 +1,46 @@
-import os
+"""
+font_utils.py
+
+Font resolution and loading for the image renderer.
+
+Fonts are cached in two tiers so that, once warm, loading a font is a
+dictionary lookup:
+
+    - Font files referenced by blob URL are downloaded once into the host-local
+      store shared by all workers (shared/utils/local_store.py, or FONT_CACHE_DIR
+      when set) and opened from there by path, so FreeType maps the file instead
+      of the bytes being copied onto the Python heap.
+    - ImageFont.FreeTypeFont objects are kept in an LRU keyed by
+      (resolved path, size, index), bounded by FONT_CACHE_MAX_FONTS (default 64).
+
+The storage connection string comes from AZURE_STORAGE_CONNECTION_STRING and
+is resolved once per process. Cached fonts are shared between renders and must
+not be mutated.
+
+Functions:
+    - resolve_font_path: Map a visualStyle's font to its file URL/path and size.
+    - load_font: Return the cached FreeTypeFont for a visualStyle.
+    - clear_font_cache: Drop the in-memory font objects.
+"""
+
+import hashlib
 import json
+import os
+import threading
+from urllib.parse import unquote, urlparse
+
 from PIL import ImageFont
+
 from shared.fonts import FONT_PATHS
 from shared.utils.azure_blob_utils import download_blob_to_bytes
+from shared.utils.local_store import store_path, write_atomic
+from shared.utils.ttl_cache import TTLCache
+
+_fonts = TTLCache(maxsize=int(os.environ.get("FONT_CACHE_MAX_FONTS", "64")), ttl=0)
+_download_locks = {}
+_lock = threading.Lock()
+_conn_str = None
+
 
 def resolve_font_path(visual_style):
     font_family = visual_style.get('font', {}).get('family', 'Arial')
@@ -23,25 +61,72 @@ def resolve_font_path(visual_style):
         font_path_resolved = font_path
     return font_path_resolved, font_size, font_family
 
-def load_font(visual_style, settings_path=None, override_size=None):
+
+def _font_file_path(name: str) -> str:
+    font_cache_dir = os.environ.get("FONT_CACHE_DIR")
+    return os.path.join(font_cache_dir, name) if font_cache_dir else store_path("fonts", name)
+
+
+def _storage_connection_string(settings_path=None):
+    """AZURE_STORAGE_CONNECTION_STRING, resolved once; an explicit `settings_path` is read instead (local tooling)."""
+    global _conn_str
+    if settings_path:
+        with open(settings_path, 'r') as f:
+            conn_str = json.load(f)['Values'].get('AZURE_STORAGE_CONNECTION_STRING')
+    else:
+        if _conn_str is None:
+            _conn_str = os.environ.get('AZURE_STORAGE_CONNECTION_STRING') or ''
+        conn_str = _conn_str
+    if not conn_str or 'UseDevelopmentStorage=true' in conn_str:
+        raise Exception("AZURE_STORAGE_CONNECTION_STRING is not set to a real Azure Storage account.")
+    return conn_str
+
+
+def _local_font_file(font_url: str, settings_path=None) -> str:
+    """
+    Path of the on-disk copy of the font at `font_url`, downloading it on first use.
+    The file is written under a temporary name and renamed into place, so a
+    concurrent reader never sees a partial font.
+    """
+    name = os.path.basename(unquote(urlparse(font_url).path)) or "font.ttf"
+    digest = hashlib.sha256(font_url.encode("utf-8")).hexdigest()[:16]
+    path = _font_file_path(f"{digest}-{name}")
+    if os.path.exists(path):
+        return path
+    with _lock:
+        download_lock = _download_locks.setdefault(path, threading.Lock())
+    with download_lock:
+        if not os.path.exists(path):
+            font_bytes = download_blob_to_bytes(font_url, _storage_connection_string(settings_path))
+            write_atomic(path, font_bytes.getbuffer())
+    return path
+
+
+def load_font(visual_style, settings_path=None, override_size=None, index=0):
+    """
+    Return the FreeTypeFont for `visual_style` (at `override_size` when given),
+    from the in-memory LRU when possible. Falls back to Pillow's default font if
+    the font cannot be loaded; the fallback is not cached, so the next call retries.
+    """
     font_path_resolved, font_size, font_family = resolve_font_path(visual_style)
     if override_size is not None:
         font_size = override_size
-    font = None
+    key = (font_path_resolved, font_size, index)
+    font = _fonts.get(key)
+    if font is not None:
+        return font
     try:
         if isinstance(font_path_resolved, str) and font_path_resolved.startswith('http'):
-            if not settings_path:
-                settings_path = os.path.join(os.path.dirname(__file__), '../../local.settings.json')
-            with open(settings_path, 'r') as f:
-                settings = json.load(f)
-            conn_str = settings['Values'].get('AZURE_STORAGE_CONNECTION_STRING')
-            if not conn_str or 'UseDevelopmentStorage=true' in conn_str:
-                raise Exception("AZURE_STORAGE_CONNECTION_STRING is not set to a real Azure Storage account.")
-            font_bytes = download_blob_to_bytes(font_path_resolved, conn_str)
-            font = ImageFont.truetype(font_bytes, font_size)
+            font_file = _local_font_file(font_path_resolved, settings_path)
         else:
-            font = ImageFont.truetype(font_path_resolved, font_size)
+            font_file = font_path_resolved
+        font = ImageFont.truetype(font_file, font_size, index=index)
     except Exception as e:
         print(f"[FontUtils] Failed to load font '{font_family}' at '{font_path_resolved}': {e}")
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
+    _fonts.set(key, font)
     return font
+
+
+def clear_font_cache():
+    _fonts.clear()
@@ -0,0 +1,90 @@
+"""
+http_utils.py
+
+Shared outbound HTTP clients. Every call site reuses one pooled keep-alive
+session per worker process instead of opening a new TCP+TLS connection per
+request, with default connect/read timeouts and retry with backoff.
+
+The sync client is a requests.Session mounted with a pooled HTTPAdapter. Only
+connection failures are retried for non-idempotent methods (POST/PATCH), so a
+request that reached the server is never sent twice; idempotent methods are
+also retried on 429/5xx responses, honouring Retry-After.
+
+Settings (environment variables):
+    HTTP_CONNECT_TIMEOUT_SECONDS  default 5
+    HTTP_READ_TIMEOUT_SECONDS     default 30
+    HTTP_MAX_RETRIES              default 3
+    HTTP_BACKOFF_FACTOR           default 0.5
+    HTTP_POOL_MAXSIZE             connections kept per host, default 20
+
+Functions:
+    - get_http_session: Return the process-wide requests session.
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_lock = threading.Lock()
+
+
+def _connect_timeout():
+    return float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+
+
+def _read_timeout():
+    return float(os.environ.get("HTTP_READ_TIMEOUT_SECONDS", "30"))
+
+
+def _max_retries():
+    return int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+
+
+def _pool_maxsize():
+    return int(os.environ.get("HTTP_POOL_MAXSIZE", "20"))
+
+
+class _TimeoutSession(requests.Session):
+    """requests.Session that applies the default (connect, read) timeout when a call passes none."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (_connect_timeout(), _read_timeout()))
+        return super().request(method, url, **kwargs)
+
+
+def _build_session():
+    retry = Retry(
+        total=_max_retries(),
+        connect=_max_retries(),
+        read=_max_retries(),
+        status=_max_retries(),
+        backoff_factor=float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5")),
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # Idempotent methods only
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=_pool_maxsize(), max_retries=retry)
+    session = _TimeoutSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session():
+    """
+    Return the process-wide requests session, creating it on first use.
+    Safe to share between threads; connections are kept alive per host.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
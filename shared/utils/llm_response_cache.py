@@ -0,0 +1,135 @@
+"""
+llm_response_cache.py
+
+Exact-match cache of parsed Azure OpenAI responses, for templates that opt in
+with `"response_cache": true` in their prompt_template (typically low
+temperature templates whose previews and regenerations repeat the same prompt).
+
+Entries are keyed by a SHA-256 hash of the deployment, rendered messages,
+temperature, max_tokens and n, so any change to the prompt or its settings misses.
+A process-local TTL/LRU cache answers repeats on the same worker; an optional
+persistent backend shares entries between workers:
+
+    LLM_RESPONSE_CACHE_TTL_SECONDS   default 3600 (a template may override with response_cache_ttl_seconds)
+    LLM_RESPONSE_CACHE_MAX_ENTRIES   default 1024
+    LLM_RESPONSE_CACHE_BACKEND       "redis" to use REDIS_CONNECTION_STRING; unset for in-process only
+
+Any object with get(key) and set(key, value, ttl) methods can be plugged in with
+set_persistent_backend. Backend failures are logged and treated as misses.
+
+Functions:
+    - response_cache_enabled: Whether a template allows cached responses.
+    - response_cache_key: Hash of the fields of a chat request that determine the response.
+    - get_cached_response / store_response: Look up and store parsed responses.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+
+from shared.logger import structured_logger
+from shared.utils.ttl_cache import TTLCache
+
+_KEY_PREFIX = "llm-response:"
+
+_cache = TTLCache(
+    maxsize=int(os.environ.get("LLM_RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.environ.get("LLM_RESPONSE_CACHE_TTL_SECONDS", "3600")),
+)
+_backend = None
+_backend_resolved = False
+_lock = threading.Lock()
+
+
+class RedisResponseCacheBackend:
+    """Persistent backend storing JSON-encoded responses in Redis with an expiry."""
+
+    def __init__(self, url=None):
+        import redis
+        self.client = redis.from_url(url or os.environ["REDIS_CONNECTION_STRING"])
+
+    def get(self, key):
+        value = self.client.get(_KEY_PREFIX + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(_KEY_PREFIX + key, json.dumps(value), ex=int(ttl) if ttl and ttl > 0 else None)
+
+
+def set_persistent_backend(backend):
+    """Plugs in a persistent backend (or None for in-process caching only)."""
+    global _backend, _backend_resolved
+    with _lock:
+        _backend = backend
+        _backend_resolved = True
+
+
+def get_persistent_backend():
+    """The configured persistent backend, created from LLM_RESPONSE_CACHE_BACKEND on first use."""
+    global _backend, _backend_resolved
+    if not _backend_resolved:
+        with _lock:
+            if not _backend_resolved:
+                if os.environ.get("LLM_RESPONSE_CACHE_BACKEND", "").lower() == "redis":
+                    _backend = RedisResponseCacheBackend()
+                _backend_resolved = True
+    return _backend
+
+
+def response_cache_enabled(prompt_template: dict) -> bool:
+    return bool(prompt_template.get("response_cache", False))
+
+
+def response_cache_ttl(prompt_template: dict):
+    """The template's response_cache_ttl_seconds, or None for the default TTL."""
+    ttl = prompt_template.get("response_cache_ttl_seconds")
+    return float(ttl) if ttl is not None else None
+
+
+def response_cache_key(chat_request: dict) -> str:
+    """Hash of the deployment, rendered messages, temperature, max_tokens, n and response_format of a chat request."""
+    material = json.dumps(
+        {
+            "model": chat_request.get("model"),
+            "messages": chat_request.get("messages"),
+            "temperature": chat_request.get("temperature"),
+            "max_tokens": chat_request.get("max_tokens"),
+            "n": chat_request.get("n", 1),
+            "response_format": chat_request.get("response_format"),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key: str):
+    """Returns a copy of the cached response for `key`, or None on a miss."""
+    value = _cache.get(key)
+    if value is None:
+        backend = get_persistent_backend()
+        if backend is not None:
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                structured_logger.error("LLM response cache read failed", error=str(e))
+            if value is not None:
+                _cache.set(key, value)
+    # Callers may modify the content they get back
+    return copy.deepcopy(value)
+
+
+def store_response(key: str, value, ttl=None):
+    _cache.set(key, copy.deepcopy(value), ttl)
+    backend = get_persistent_backend()
+    if backend is not None:
+        try:
+            backend.set(key, value, ttl if ttl is not None else _cache.ttl)
+        except Exception as e:
+            structured_logger.error("LLM response cache write failed", error=str(e))
+
+
+def clear_response_cache():
+    _cache.clear()
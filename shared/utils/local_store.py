@@ -0,0 +1,78 @@
+"""
+local_store.py
+
+Host-local file store shared by every Functions worker process on the host
+(FUNCTIONS_WORKER_PROCESS_COUNT). Files live under LOCAL_CACHE_DIR (default
+<tmp>/autogensocial-cache), are written once by whichever worker gets there
+first and are read through read-only memory maps, so N workers share one copy
+in the OS page cache instead of each downloading and holding its own.
+
+Writes go to a temporary file in the same directory and are renamed over the
+target, so readers see either the old or the new file and never a partial one.
+Two workers missing the same file at once may both fetch it; the rename keeps
+that harmless.
+
+Functions:
+    - store_path: Path of a file in a namespace of the store.
+    - write_atomic: Atomically create or replace a file.
+    - read_mapped: Read-only memory map of a file.
+    - file_version: Modification stamp used to detect replacement.
+    - remove: Delete a file if it exists.
+"""
+
+import mmap
+import os
+import tempfile
+
+
+def _root():
+    return os.environ.get("LOCAL_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "autogensocial-cache")
+
+
+def store_path(namespace: str, name: str) -> str:
+    return os.path.join(_root(), namespace, name)
+
+
+def write_atomic(path: str, data) -> str:
+    """Writes `data` (bytes-like) to `path` via a temporary file and os.replace; returns `path`."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def read_mapped(path: str):
+    """
+    Read-only mmap of `path`, or None if it does not exist. The map stays valid
+    after the file is replaced or removed (it keeps the old inode); close it when done.
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+
+def file_version(path: str):
+    """(mtime_ns, inode) of `path`, or None if it does not exist; changes whenever the file is replaced."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino
+
+
+def remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
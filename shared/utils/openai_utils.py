@@ -0,0 +1,204 @@
+"""
+openai_utils.py
+
+Registry of Azure OpenAI clients shared by text generation and media ranking.
+Clients are created once per (endpoint, api_version, deployment) and reused for
+the lifetime of the worker process, so every generation reuses the client's
+pooled keep-alive connections instead of constructing a client and opening a
+cold TLS connection per call.
+
+AsyncAzureOpenAI clients hold an httpx.AsyncClient bound to the event loop that
+created them, so they are pooled per (event loop, endpoint, api_version, deployment).
+
+Settings default to the AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY,
+AZURE_OPENAI_API_VERSION and AZURE_OPENAI_DEPLOYMENT_NAME environment variables.
+
+Chat completions go through create_chat_completion(_async), which waits for
+the deployment's TPM/RPM rate limiter (shared/utils/rate_limiter.py) before each
+attempt and retries throttled (429, honouring Retry-After), 5xx and connection
+failures up to AZURE_OPENAI_MAX_RETRIES times (default 3). The SDK's own
+retries are disabled so every attempt passes through the limiter. Throttling
+that outlasts the retries raises StageError(429) rather than a generic error.
+
+Functions:
+    - get_openai_settings: Return the Azure OpenAI settings from the environment.
+    - get_openai_client: Return the pooled AzureOpenAI client.
+    - get_async_openai_client: Return the pooled AsyncAzureOpenAI client for the running loop.
+    - create_chat_completion: Rate-limited chat completion with retries.
+    - create_chat_completion_async: Async variant of create_chat_completion.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+import openai
+
+from shared.errors import StageError
+from shared.utils.rate_limiter import estimate_tokens, get_rate_limiter
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {key: client}
+_lock = threading.Lock()
+
+
+def get_openai_settings() -> dict:
+    return {
+        "endpoint": os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        "api_key": os.environ.get("AZURE_OPENAI_API_KEY"),
+        "api_version": os.environ.get("AZURE_OPENAI_API_VERSION"),
+        "deployment": os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME"),
+    }
+
+
+def _resolve(endpoint, api_key, api_version, deployment):
+    settings = get_openai_settings()
+    return (
+        endpoint or settings["endpoint"],
+        api_key or settings["api_key"],
+        api_version or settings["api_version"],
+        deployment or settings["deployment"],
+    )
+
+
+def get_openai_client(endpoint=None, api_key=None, api_version=None, deployment=None):
+    """
+    Return the process-wide AzureOpenAI client for (endpoint, api_version, deployment),
+    creating it on first use.
+    """
+    endpoint, api_key, api_version, deployment = _resolve(endpoint, api_key, api_version, deployment)
+    key = (endpoint, api_version, deployment)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = openai.AzureOpenAI(
+                    api_key=api_key,
+                    api_version=api_version,
+                    azure_endpoint=endpoint,
+                    azure_deployment=deployment,
+                    max_retries=0  # Retried through the rate limiter instead
+                )
+                _clients[key] = client
+    return client
+
+
+def get_async_openai_client(endpoint=None, api_key=None, api_version=None, deployment=None):
+    """
+    Return the AsyncAzureOpenAI client for (endpoint, api_version, deployment)
+    bound to the running event loop. Must be called from within a coroutine.
+    """
+    endpoint, api_key, api_version, deployment = _resolve(endpoint, api_key, api_version, deployment)
+    key = (endpoint, api_version, deployment)
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        with _lock:
+            clients = _async_clients.setdefault(loop, {})
+    client = clients.get(key)
+    if client is None:
+        client = openai.AsyncAzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            azure_deployment=deployment,
+            max_retries=0  # Retried through the rate limiter instead
+        )
+        clients[key] = client
+    return client
+
+
+def _max_retries():
+    return int(os.environ.get("AZURE_OPENAI_MAX_RETRIES", "3"))
+
+
+def _retry_delay(error, attempt: int):
+    """
+    Seconds to wait before retrying `error`, or None if it is not retryable.
+    Throttling honours the Retry-After (or retry-after-ms) header.
+    """
+    if isinstance(error, openai.RateLimitError):
+        headers = error.response.headers if error.response is not None else {}
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            try:
+                return float(headers["retry-after"])
+            except ValueError:
+                pass
+        return 2.0 ** attempt
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return 0.5 * 2 ** attempt
+    return None
+
+
+def _raise_final(error):
+    if isinstance(error, openai.RateLimitError):
+        raise StageError("Azure OpenAI rate limit exceeded; retry later.", 429) from error
+    raise error
+
+
+def create_chat_completion(chat_request: dict, client=None, limiter=None, max_retries=None, on_send=None):
+    """
+    Runs `chat_request` on `client` (default: the pooled client for its model/deployment)
+    within the deployment's rate limits, retrying throttling and transient failures
+    up to `max_retries` times (default AZURE_OPENAI_MAX_RETRIES).
+    `on_send()`, if given, is called each time the request leaves the rate limiter to be sent.
+    """
+    deployment = chat_request["model"]
+    client = client or get_openai_client(deployment=deployment)
+    limiter = limiter or get_rate_limiter(deployment)
+    estimated = estimate_tokens(chat_request)
+    max_retries = _max_retries() if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        limiter.acquire(estimated)
+        if on_send is not None:
+            on_send()
+        try:
+            response = client.chat.completions.create(**chat_request)
+        except openai.OpenAIError as e:
+            limiter.record_usage(estimated, 0)  # Failed attempts do not consume quota
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                _raise_final(e)
+            if isinstance(e, openai.RateLimitError):
+                limiter.block_for(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.record_usage(estimated, getattr(getattr(response, "usage", None), "total_tokens", None))
+        return response
+
+
+async def create_chat_completion_async(chat_request: dict, client=None, limiter=None, max_retries=None, on_send=None):
+    """Async variant of create_chat_completion built on the AsyncAzureOpenAI client."""
+    deployment = chat_request["model"]
+    client = client or get_async_openai_client(deployment=deployment)
+    limiter = limiter or get_rate_limiter(deployment)
+    estimated = estimate_tokens(chat_request)
+    max_retries = _max_retries() if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        await limiter.acquire_async(estimated)
+        if on_send is not None:
+            on_send()
+        try:
+            response = await client.chat.completions.create(**chat_request)
+        except openai.OpenAIError as e:
+            limiter.record_usage(estimated, 0)
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                _raise_final(e)
+            if isinstance(e, openai.RateLimitError):
+                limiter.block_for(delay)
+            else:
+                await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limiter.record_usage(estimated, getattr(getattr(response, "usage", None), "total_tokens", None))
+        return response
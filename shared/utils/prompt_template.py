@@ -0,0 +1,123 @@
+"""
+prompt_template.py
+
+Compiled `{{var}}` prompt templates. A prompt is parsed once into literal
+segments and variable slots and turned into a positional format string, so
+rendering is a single pass over the output instead of one full-string
+`str.replace` per variable.
+
+Placeholders with no value are left in the output unchanged (as the previous
+str.replace rendering did); `missing` and `extra` report the mismatch so callers
+can log or reject it.
+
+Compiled prompts are cached by prompt text, so a template's prompts are compiled
+once and an edited template (new text) is compiled afresh.
+
+Usage Example:
+    prompt = compile_prompt("Write about {{topic}} for {{audience}}.")
+    prompt.render({"topic": "coffee", "audience": "students"})
+    prompt.render_many([{"topic": "tea", "audience": "chefs"}, {"topic": "beer", "audience": "brewers"}])
+    prompt.missing({"topic": "coffee"})  # -> ["audience"]
+
+select_variable_values picks one random value per variable defined in a
+template's prompt_template.variables; select_variable_value_sets picks several
+such combinations for multi-variant generation.
+"""
+
+import random
+import re
+from functools import lru_cache
+
+_PLACEHOLDER = re.compile(r"\{\{([^{}]+)\}\}")
+
+
+class CompiledPrompt:
+    """A `{{var}}` prompt parsed into literal segments and variable slots."""
+
+    def __init__(self, text: str):
+        self.text = text
+        literals, self.slots = [], []
+        position = 0
+        for match in _PLACEHOLDER.finditer(text):
+            literals.append(text[position:match.start()])
+            self.slots.append(match.group(1))
+            position = match.end()
+        literals.append(text[position:])
+        self.literals = literals
+        self.variables = tuple(dict.fromkeys(self.slots))  # Unique names in order of appearance
+        # Literal braces are escaped so str.format only fills the slots
+        escaped = [literal.replace("{", "{{").replace("}", "}}") for literal in literals]
+        index = {name: i for i, name in enumerate(self.variables)}
+        self._format = escaped[0] + "".join(
+            "{%d}%s" % (index[name], literal) for name, literal in zip(self.slots, escaped[1:])
+        )
+
+    def _args(self, values: dict) -> list:
+        return [
+            str(values[name]) if name in values else "{{" + name + "}}"
+            for name in self.variables
+        ]
+
+    def render(self, values: dict) -> str:
+        """Renders the prompt in one pass; unknown placeholders are left as written."""
+        if not self.variables:
+            return self.text
+        return self._format.format(*self._args(values))
+
+    def render_many(self, value_sets) -> list:
+        """Renders the prompt once per dict of values in `value_sets`."""
+        if not self.variables:
+            return [self.text for _ in value_sets]
+        fill = self._format.format
+        args = self._args
+        return [fill(*args(values)) for values in value_sets]
+
+    def missing(self, values: dict) -> list:
+        """Placeholders in the prompt without a value in `values`."""
+        return [name for name in self.variables if name not in values]
+
+    def extra(self, values: dict) -> list:
+        """Keys of `values` the prompt has no placeholder for."""
+        return [name for name in values if name not in self.variables]
+
+
+@lru_cache(maxsize=512)
+def compile_prompt(text: str) -> CompiledPrompt:
+    """Return the compiled form of `text`, compiling it on first use."""
+    return CompiledPrompt(text or "")
+
+
+def select_variable_values(prompt_template: dict, variable_values: dict) -> dict:
+    """
+    Randomly selects one value for each template variable, if variables exist.
+    Falls back to the request's variable values when the template defines none.
+    """
+    variable_values_random = {}
+    variables = prompt_template.get("variables")
+    if variables:
+        for var in variables:
+            name = var.get("name")
+            values = var.get("values", [])
+            if name and values:
+                variable_values_random[name] = random.choice(values)
+    return variable_values_random or variable_values
+
+
+def select_variable_value_sets(prompt_template: dict, variable_values: dict, count: int) -> list:
+    """
+    Picks `count` variable combinations with select_variable_values, avoiding
+    repeats while the template's variables allow distinct combinations.
+    """
+    value_sets, seen = [], set()
+    for _ in range(count * 4):
+        values = select_variable_values(prompt_template, variable_values)
+        key = tuple(sorted((name, str(value)) for name, value in values.items()))
+        if key not in seen:
+            seen.add(key)
+            value_sets.append(values)
+            if len(value_sets) == count:
+                return value_sets
+    # Fewer distinct combinations than requested: repeat picks to fill the count
+    while len(value_sets) < count:
+        value_sets.append(select_variable_values(prompt_template, variable_values))
+    return value_sets
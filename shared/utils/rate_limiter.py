@@ -0,0 +1,146 @@
+"""
+rate_limiter.py
+
+Client-side token buckets for Azure OpenAI tokens-per-minute (TPM) and
+requests-per-minute (RPM) quotas.
+
+Each call reserves one request and its estimated prompt+completion tokens
+before it is sent. Reservations are taken in arrival order and may run the
+bucket into debt; each caller then waits until its own reservation is covered,
+so callers are served first-come first-served and throughput stays at the
+configured rate instead of bursting into 429s. After the call the estimate is
+corrected with the actual usage. A 429 blocks the whole limiter for the
+Retry-After interval.
+
+Limits are per deployment (AZURE_OPENAI_TPM_LIMIT / AZURE_OPENAI_RPM_LIMIT by
+default; 0 disables a limit). Buckets hold at most one minute of quota.
+
+Buckets live in process memory, so each worker process enforces its own share
+of the quota: the configured limits are divided by the number of processes
+that share it, FUNCTIONS_WORKER_PROCESS_COUNT (default 1) per instance times
+AZURE_OPENAI_RATE_LIMIT_INSTANCES (default 1). When the app scales out, set
+the latter to the maximum instance count so the instances together stay
+within the deployment's quota.
+
+Functions:
+    - estimate_tokens: Estimate the prompt+completion tokens of a chat request.
+    - get_rate_limiter: Return the limiter for a deployment.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+# Rough characters-per-token ratio for English prompts, plus per-message overhead
+_CHARS_PER_TOKEN = 4
+_TOKENS_PER_MESSAGE = 4
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def _process_share() -> int:
+    """Number of worker processes the configured limits are split across."""
+    workers = int(os.environ.get("FUNCTIONS_WORKER_PROCESS_COUNT", "1"))
+    instances = int(os.environ.get("AZURE_OPENAI_RATE_LIMIT_INSTANCES", "1"))
+    return max(1, workers) * max(1, instances)
+
+
+def estimate_tokens(chat_request: dict) -> int:
+    """Estimates prompt tokens from the message text plus max_tokens for each of the `n` completions."""
+    prompt_tokens = sum(
+        len(str(message.get("content") or "")) // _CHARS_PER_TOKEN + _TOKENS_PER_MESSAGE
+        for message in chat_request.get("messages", [])
+    )
+    return prompt_tokens + int(chat_request.get("max_tokens") or 0) * int(chat_request.get("n") or 1)
+
+
+class TokenBucket:
+    """A bucket of `capacity` units refilled continuously at `rate` units per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Takes `amount` (possibly into debt) and returns the seconds until it is covered. Caller holds the lock."""
+        self._refill(now)
+        self._tokens -= min(amount, self.capacity)
+        return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount: float, now: float):
+        """Returns (positive) or charges (negative) units after the actual usage is known."""
+        self._refill(now)
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """TPM and RPM buckets for one deployment; a limit of 0 (or None) is unlimited."""
+
+    def __init__(self, tokens_per_minute=0, requests_per_minute=0):
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0) if requests_per_minute else None
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            return wait
+
+    def acquire(self, tokens: int) -> float:
+        """Blocks until the request and its `tokens` fit the budget; returns the seconds waited."""
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int) -> float:
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated: int, actual):
+        """Corrects the token bucket once the response reports the tokens actually used."""
+        if self.tokens and actual is not None:
+            with self._lock:
+                self.tokens.adjust(estimated - actual, time.monotonic())
+
+    def block_for(self, seconds: float):
+        """Holds back every caller for `seconds` (the Retry-After of a 429)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(deployment, tokens_per_minute=None, requests_per_minute=None) -> RateLimiter:
+    """
+    Return the process-wide limiter for `deployment`, creating it on first use with the
+    given limits or AZURE_OPENAI_TPM_LIMIT / AZURE_OPENAI_RPM_LIMIT, divided into this
+    process's share of the quota.
+    """
+    limiter = _limiters.get(deployment)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(deployment)
+            if limiter is None:
+                if tokens_per_minute is None:
+                    tokens_per_minute = int(os.environ.get("AZURE_OPENAI_TPM_LIMIT", "0"))
+                if requests_per_minute is None:
+                    requests_per_minute = int(os.environ.get("AZURE_OPENAI_RPM_LIMIT", "0"))
+                share = _process_share()
+                limiter = RateLimiter(tokens_per_minute / share, requests_per_minute / share)
+                _limiters[deployment] = limiter
+    return limiter
@@ -0,0 +1,128 @@
+"""
+stream_utils.py
+
+Helpers for the streaming HTTP endpoints: NDJSON / server-sent event
+formatting of {"event", "data"} dicts, and an incremental reader that pulls one
+top-level string field (e.g. "text") out of a JSON object while it is still
+being generated, so partial content can be shown before the JSON is complete.
+
+Functions:
+    - wants_sse: Whether a request asked for server-sent events.
+    - format_ndjson / format_sse: Serialize one event.
+"""
+
+import json
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+# Keeps proxies from buffering or caching the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def wants_sse(query_params, headers) -> bool:
+    """Server-sent events with ?format=sse or `Accept: text/event-stream`; NDJSON otherwise."""
+    return query_params.get("format") == "sse" or SSE_MEDIA_TYPE in headers.get("accept", "")
+
+
+def format_ndjson(event: dict) -> str:
+    return json.dumps(event, default=str) + "\n"
+
+
+def format_sse(event: dict) -> str:
+    if event["event"] == "heartbeat":
+        return ": heartbeat\n\n"  # SSE comment line; ignored by EventSource clients
+    return f"event: {event['event']}\ndata: {json.dumps(event.get('data'), default=str)}\n\n"
+
+
+class JsonFieldStreamer:
+    """
+    Feeds chunks of a JSON object and returns the newly decoded characters of the
+    top-level string field `field` (matched case-insensitively). Output that does
+    not start with '{' is not JSON and is passed through as the field's text.
+    The decoded preview is best effort; the complete document should still be parsed at the end.
+    """
+
+    def __init__(self, field: str = "text"):
+        self.field = field.lower()
+        self.mode = None  # "json" or "plain" once the first non-space character is seen
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.unicode_digits = None
+        self.expecting_key = False
+        self.reading_key = False
+        self.key = []
+        self.last_key = None
+        self.after_colon = False
+        self.capturing = False
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for ch in chunk:
+            if self.mode is None:
+                if ch.isspace():
+                    continue
+                self.mode = "json" if ch == "{" else "plain"
+            if self.mode == "plain":
+                out.append(ch)
+            else:
+                self._step(ch, out)
+        return "".join(out)
+
+    def _emit(self, ch, out):
+        if self.reading_key:
+            self.key.append(ch)
+        elif self.capturing:
+            out.append(ch)
+
+    def _step(self, ch, out):
+        if self.in_string:
+            if self.unicode_digits is not None:
+                self.unicode_digits += ch
+                if len(self.unicode_digits) == 4:
+                    try:
+                        self._emit(chr(int(self.unicode_digits, 16)), out)
+                    except ValueError:
+                        pass
+                    self.unicode_digits = None
+            elif self.escape:
+                self.escape = False
+                if ch == "u":
+                    self.unicode_digits = ""
+                else:
+                    self._emit(_ESCAPES.get(ch, ch), out)
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.reading_key:
+                    self.reading_key = False
+                    self.last_key = "".join(self.key).lower()
+                self.capturing = False
+            else:
+                self._emit(ch, out)
+            return
+        if ch == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expecting_key:
+                self.reading_key = True
+                self.key = []
+            elif self.depth == 1 and self.after_colon and self.last_key == self.field:
+                self.capturing = True
+            self.after_colon = False
+        elif ch in "{[":
+            self.depth += 1
+            self.expecting_key = self.depth == 1 and ch == "{"
+            self.after_colon = False
+        elif ch in "}]":
+            self.depth -= 1
+        elif self.depth == 1 and ch == ":":
+            self.expecting_key = False
+            self.after_colon = True
+        elif self.depth == 1 and ch == ",":
+            self.expecting_key = True
+            self.last_key = None
+        elif not ch.isspace():
+            self.after_colon = False
@@ -0,0 +1,116 @@
+"""
+template_cache.py
+
+In-process cache of template documents keyed by (brandId, templateId), so
+scheduled bursts that regenerate the same templates hit Cosmos DB only when a
+template changes. Entries expire after TEMPLATE_CACHE_TTL_SECONDS (default 300)
+and the cache holds at most TEMPLATE_CACHE_MAX_ENTRIES templates (default 256).
+
+Below the in-process cache, template documents are kept as JSON files in the
+host-local store (shared/utils/local_store.py), so the first worker on a host to
+read a template from Cosmos DB serves it to every other worker. A stored file
+older than the TTL is read from Cosmos DB again.
+
+The templates change feed (blueprints/scheduling/cosmos_trigger) calls
+invalidate_template for every changed document, which also removes the stored
+file. In-process entries remember the version of the file they were loaded
+from and are dropped when it changes, so every worker on that host picks up the
+edit. Workers on other hosts rely on the TTL.
+
+Cached documents are shared between requests and must be treated as read-only.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from shared.tracing import span
+from shared.utils.local_store import file_version, read_mapped, remove, store_path, write_atomic
+from shared.utils.ttl_cache import TTLCache
+
+_cache = TTLCache(
+    maxsize=int(os.environ.get("TEMPLATE_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.environ.get("TEMPLATE_CACHE_TTL_SECONDS", "300")),
+)
+
+
+def _shared_path(brand_id, template_id) -> str:
+    digest = hashlib.sha256(json.dumps([brand_id, template_id]).encode("utf-8")).hexdigest()
+    return store_path("templates", f"{digest}.json")
+
+
+def _cached(key, path):
+    """The in-process entry for `key`, unless the shared file it was loaded from has since changed."""
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    template_db, version = entry
+    if file_version(path) != version:
+        _cache.pop(key)
+        return None
+    return template_db
+
+
+def _read_shared(key, path):
+    """Loads the template from the host-local store if it is there and younger than the TTL."""
+    version = file_version(path)
+    if version is None or (_cache.ttl > 0 and time.time() - version[0] / 1e9 > _cache.ttl):
+        return None
+    mapped = read_mapped(path)
+    if mapped is None:
+        return None
+    try:
+        template_db = json.loads(mapped[:])
+    except ValueError:
+        return None
+    finally:
+        mapped.close()
+    _cache.set(key, (template_db, version))
+    return template_db
+
+
+def _write_shared(key, path, template_db):
+    try:
+        write_atomic(path, json.dumps(template_db).encode("utf-8"))
+        version = file_version(path)
+    except OSError:
+        version = None  # The in-process cache still works without the shared store
+    _cache.set(key, (template_db, version))
+
+
+def get_template(templates_container, brand_id, template_id):
+    """
+    Return the template document, reading it from `templates_container`
+    (partition key is templateInfo.brandId) only when neither this worker nor
+    the host-local store has a current copy.
+    """
+    key = (brand_id, template_id)
+    path = _shared_path(brand_id, template_id)
+    template_db = _cached(key, path) or _read_shared(key, path)
+    if template_db is None:
+        with span("cosmos.read_template", template_id=template_id):
+            template_db = templates_container.read_item(item=template_id, partition_key=brand_id)
+        _write_shared(key, path, template_db)
+    return template_db
+
+
+async def get_template_async(templates_container, brand_id, template_id):
+    """Async variant of get_template for an azure.cosmos.aio container."""
+    key = (brand_id, template_id)
+    path = _shared_path(brand_id, template_id)
+    template_db = _cached(key, path) or _read_shared(key, path)
+    if template_db is None:
+        with span("cosmos.read_template", template_id=template_id):
+            template_db = await templates_container.read_item(item=template_id, partition_key=brand_id)
+        _write_shared(key, path, template_db)
+    return template_db
+
+
+def invalidate_template(brand_id, template_id):
+    _cache.pop((brand_id, template_id))
+    remove(_shared_path(brand_id, template_id))
+
+
+def clear_template_cache():
+    _cache.clear()
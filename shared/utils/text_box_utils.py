@@ -6,19 +6,85 @@ is wrapped, resized, and (if necessary) truncated so it fits neatly within a
 specified container area.
 
 Functions:
+    - wrap_text_to_width: Greedily wrap text to a pixel width.
     - calculate_text_box: Determine wrapped text, box dimensions, and placement.
     - draw_text_box: Render a semi-transparent background box and draw the text.
 """
 
 from PIL import ImageDraw, ImageFont
 import textwrap
+import weakref
 from shared.utils.font_utils import load_font
 
+# Per-font memo of word measurements; fonts are long-lived (see font_utils), so words repeat across renders
+_word_metrics = weakref.WeakKeyDictionary()
+_MAX_MEMOIZED_WORDS = 4096
+
+
+def _measure_word(font, word):
+    """(advance, ink left, ink right) of `word`, measured once per font."""
+    metrics = _word_metrics.get(font)
+    if metrics is None or len(metrics) > _MAX_MEMOIZED_WORDS:
+        metrics = _word_metrics[font] = {}
+    measured = metrics.get(word)
+    if measured is None:
+        left, _, right, _ = font.getbbox(word)
+        measured = metrics[word] = (font.getlength(word), left, right)
+    return measured
+
+
+def _line_width(font, line):
+    """Inked width of a single line, as ImageDraw.textbbox measures it."""
+    bbox = font.getbbox(line)
+    return bbox[2] - bbox[0]
+
+
+def wrap_text_to_width(text, font, max_width):
+    """
+    Greedily wraps each paragraph of `text` so no line is wider than `max_width` pixels.
+
+    Each word's advance width and ink extent are measured once per font and
+    memoized; a line's inked width is then the advances of its words and spaces
+    from the first word's ink to the last word's ink, so wrapping is linear in
+    the text length. That sum ignores kerning across spaces, so a line that lands
+    within a tenth of an em of the limit is measured exactly before the break is
+    decided; the result matches wrapping by textbbox.
+    """
+    space = font.getlength(" ")
+    tolerance = getattr(font, "size", 10) / 10
+    lines = []
+    for paragraph in text.split('\n'):
+        words = paragraph.split()
+        if not words:
+            lines.append('')
+            continue
+        line = [words[0]]
+        advance, first_left, _ = _measure_word(font, words[0])
+        for word in words[1:]:
+            word_advance, _, word_right = _measure_word(font, word)
+            offset = advance + space
+            width = offset + word_right - first_left
+            if width <= max_width - tolerance:
+                fits = True
+            elif width > max_width + tolerance:
+                fits = False
+            else:
+                fits = _line_width(font, " ".join(line + [word])) <= max_width
+            if fits:
+                line.append(word)
+                advance = offset + word_advance
+            else:
+                lines.append(" ".join(line))
+                line = [word]
+                advance, first_left, _ = _measure_word(font, word)
+        lines.append(" ".join(line))
+    return '\n'.join(lines)
+
 
 def calculate_text_box(draw, text, font, container_width, container_height,
                        container_padding=0, min_font_size=10, visual_style=None, settings_path=None,
                        max_box_width_pct=0.8, max_box_height_pct=0.8,
-                       horizontal_align='center', vertical_align='middle'):
+                       horizontal_align='center', vertical_align='middle', autofit=True):
     """
     Calculate a text box that fits within a container area by wrapping, resizing,
     and truncating text as needed. Returns wrapped text, dimensions, placement, and
@@ -38,14 +104,17 @@ def calculate_text_box(draw, text, font, container_width, container_height,
         max_box_height_pct (float): Max height of box as percent of container (default 0.8).
         horizontal_align (str): 'left', 'center', or 'right'.
         vertical_align (str): 'top', 'middle', or 'bottom'.
+        autofit (bool): Shrink the font to fit before truncating (default True).
 
     Returns:
         dict: Box info and layout details.
 
     Notes:
         - The function first attempts to wrap lines so the box_width ≤ max_box_width.
-        - If wrapping alone cannot fit the text (either width or height), it reduces
-          the font size one point at a time down to `min_font_size`.
+        - If wrapping alone cannot fit the text (either width or height), it
+          binary-searches the largest font size between `min_font_size` and the
+          initial size whose wrapped layout fits, so only O(log n) layouts are made.
+          Fonts come from the font cache and word widths are memoized across probes.
         - If, at `min_font_size`, the box is still too tall, the text is truncated
           with an ellipsis on the last visible line.
         - The returned (x, y) center the box within the padded container area.
@@ -83,32 +152,42 @@ def calculate_text_box(draw, text, font, container_width, container_height,
         pad_y = max(int(text_h * 0.05), 10)
         return pad_x, pad_y
 
-    def wrap_text_to_width(text, font, max_width):
-        lines = []
-        for paragraph in text.split('\n'):
-            words = paragraph.split()
-            if not words:
-                lines.append('')
-                continue
-            line = words[0]
-            for word in words[1:]:
-                test_line = f"{line} {word}"
-                try:
-                    bbox = draw.textbbox((0, 0), test_line, font=font)
-                    w = bbox[2] - bbox[0]
-                except AttributeError:
-                    w, _ = font.getsize(test_line)
-                if w <= max_width:
-                    line = test_line
-                else:
-                    lines.append(line)
-                    line = word
-            lines.append(line)
-        return '\n'.join(lines)
-
-    # Initial wrap to container width
-    wrapped_text = wrap_text_to_width(text, font, max_box_width - 2 * 10)
-    text_w, text_h = measure(wrapped_text, font)
+    def font_at(size):
+        if size == font.size:
+            return font
+        if visual_style:
+            return load_font(visual_style, settings_path, override_size=size)
+        return font.font_variant(size=size)
+
+    layouts = {}
+
+    def layout(size):
+        """(font, wrapped text, text_w, text_h) at `size`, computed once per probed size."""
+        if size not in layouts:
+            fnt = font_at(size)
+            wrapped = wrap_text_to_width(text, fnt, max_box_width - 2 * 10)
+            layouts[size] = (fnt, wrapped) + tuple(measure(wrapped, fnt))
+        return layouts[size]
+
+    def fits(size):
+        _, _, w, h = layout(size)
+        return w <= max_box_width and h <= max_box_height
+
+    # Wrap to container width, shrinking the font to the largest size that fits
+    font_size = getattr(font, 'size', None)
+    if autofit and isinstance(font, ImageFont.FreeTypeFont) and min_font_size < font_size and not fits(font_size):
+        low, high, font_size = min_font_size, font_size - 1, min_font_size
+        while low <= high:
+            mid = (low + high) // 2
+            if fits(mid):
+                font_size, low = mid, mid + 1
+            else:
+                high = mid - 1
+    if isinstance(font, ImageFont.FreeTypeFont):
+        font, wrapped_text, text_w, text_h = layout(font_size)
+    else:
+        wrapped_text = wrap_text_to_width(text, font, max_box_width - 2 * 10)
+        text_w, text_h = measure(wrapped_text, font)
     pad_x, pad_y = get_dynamic_padding(text_w, text_h)
     pad_y_top = pad_y_bottom = pad_y
     box_width = text_w + 2 * pad_x
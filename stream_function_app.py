@@ -0,0 +1,12 @@
+import azure.functions as func
+from blueprints.azure_openai_content_generation.azure_openai_content_stream_blueprint import text_stream_blueprint
+from blueprints.orchestrator_stream_blueprint import orchestrator_stream_blueprint
+
+# Streaming routes run in their own Function App: importing the HTTP streams extension
+# (azurefunctions-extensions-http-fastapi) switches every HTTP function in the worker to
+# FastAPI Request/Response types, so these routes cannot share function_app.py's worker.
+# Deploy this package a second time with PYTHON_SCRIPT_FILE_NAME=stream_function_app.py (see README).
+app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+
+app.register_blueprint(text_stream_blueprint)
+app.register_blueprint(orchestrator_stream_blueprint)
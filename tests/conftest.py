@@ -5,7 +5,7 @@ import openai
 import json
 import pytz
 import os
-from openai.types.completion import Completion, Choice
+from openai.types.chat.chat_completion import Choice
 from openai.types.chat import ChatCompletion, ChatCompletionMessage
 from shared.logger import structured_logger, StructuredLogger
 import redis
@@ -0,0 +1,120 @@
+import pytest
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+import shared.idempotency as idempotency
+from shared.errors import StageError
+
+
+class FakeContainer:
+    """In-memory stand-in for the idempotency container, with ETag checks on replace."""
+
+    def __init__(self):
+        self.items = {}
+        self._version = 0
+
+    def _store(self, body):
+        self._version += 1
+        self.items[body["id"]] = {**body, "_etag": str(self._version)}
+
+    def create_item(self, body):
+        if body["id"] in self.items:
+            raise CosmosResourceExistsError(message="exists")
+        self._store(body)
+
+    def read_item(self, item, partition_key):
+        if item not in self.items:
+            raise CosmosResourceNotFoundError(message="not found")
+        return dict(self.items[item])
+
+    def replace_item(self, item, body, etag=None, match_condition=None):
+        if self.items.get(item, {}).get("_etag") != etag:
+            raise CosmosAccessConditionFailedError(message="precondition failed")
+        self._store(body)
+
+    def upsert_item(self, body):
+        self._store(body)
+
+    def delete_item(self, item, partition_key):
+        self.items.pop(item, None)
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    monkeypatch.setattr(idempotency, "get_container", lambda name: container)
+    return container
+
+
+def test_begin_claims_new_key(container):
+    store = idempotency.IdempotencyStore()
+
+    assert store.begin("key-1") is None
+    assert [doc["status"] for doc in container.items.values()] == [idempotency.STATUS_IN_PROGRESS]
+
+
+def test_begin_returns_stored_response_after_complete(container):
+    store = idempotency.IdempotencyStore()
+    store.begin("key-1")
+    store.complete("key-1", {"status": "success"})
+
+    assert store.begin("key-1") == {"status": "success"}
+
+
+def test_begin_rejects_live_claim(container):
+    store = idempotency.IdempotencyStore()
+    store.begin("key-1")
+
+    with pytest.raises(StageError) as excinfo:
+        store.begin("key-1")
+    assert excinfo.value.status_code == 409
+
+
+def test_begin_takes_over_stale_claim(container, monkeypatch):
+    monkeypatch.setenv("IDEMPOTENCY_LEASE_SECONDS", "60")
+    store = idempotency.IdempotencyStore()
+    store.begin("key-1")
+    doc = next(iter(container.items.values()))
+    doc["claimedAt"] -= 120
+
+    assert store.begin("key-1") is None
+    assert next(iter(container.items.values()))["claimedAt"] > doc["claimedAt"]
+
+
+def test_run_idempotent_replays_completed_run(container):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"status": "success"}
+
+    assert idempotency.run_idempotent("key-1", compute) == ({"status": "success"}, False)
+    assert idempotency.run_idempotent("key-1", compute) == ({"status": "success"}, True)
+    assert len(calls) == 1
+
+
+def test_run_idempotent_releases_claim_on_failure(container):
+    def compute():
+        raise StageError("Stage 'render' failed", 502)
+
+    with pytest.raises(StageError):
+        idempotency.run_idempotent("key-1", compute)
+
+    assert container.items == {}
+    assert idempotency.run_idempotent("key-1", lambda: {"status": "success"}) == ({"status": "success"}, False)
+
+
+def test_run_idempotent_without_key_always_computes(container):
+    assert idempotency.run_idempotent(None, lambda: 1) == (1, False)
+    assert idempotency.run_idempotent(None, lambda: 2) == (2, False)
+    assert container.items == {}
+
+
+def test_post_id_for_key_is_stable():
+    key = idempotency.scheduled_idempotency_key("template-123", "brand-123", "2025-04-11T13:00:00")
+
+    assert idempotency.post_id_for_key(key) == idempotency.post_id_for_key(key)
+    assert idempotency.post_id_for_key(key) != idempotency.post_id_for_key(key + "x")
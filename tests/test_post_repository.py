@@ -0,0 +1,75 @@
+from unittest.mock import MagicMock
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+from shared.post_repository import PostRepository
+
+
+def _apply_patch(doc, operations):
+    """Applies Cosmos "set" patch operations the way the service does."""
+    for operation in operations:
+        assert operation["op"] == "set"
+        *parents, name = operation["path"].strip("/").split("/")
+        target = doc
+        for parent in parents:
+            target = target[parent]
+        target[name] = operation["value"]
+    return doc
+
+
+def _patch_operations(container):
+    return container.patch_item.call_args.kwargs["patch_operations"]
+
+
+def test_record_checkpoint_sets_stage_and_mirrored_fields():
+    container = MagicMock()
+    doc = {"id": "post-1", "checkpoints": {"text": {"text": "Hi"}}, "metadata": {}}
+
+    PostRepository(container).record_checkpoint(
+        "post-1", "image", {"imageUrl": "https://example.com/image.png"},
+        fields={"imageUrl": "https://example.com/image.png"}
+    )
+    _apply_patch(doc, _patch_operations(container))
+
+    assert container.patch_item.call_args.kwargs["item"] == "post-1"
+    assert doc["checkpoints"] == {
+        "text": {"text": "Hi"},
+        "image": {"imageUrl": "https://example.com/image.png"},
+    }
+    assert doc["imageUrl"] == "https://example.com/image.png"
+    assert "updatedDate" in doc["metadata"]
+
+
+def test_record_publish_result_checkpoints_only_when_asked():
+    container = MagicMock()
+    post_result = {"instagramPostId": "ig-1", "postStatus": "published"}
+    repository = PostRepository(container)
+
+    repository.record_publish_result("post-1", post_result)
+    doc = _apply_patch({"checkpoints": {}, "metadata": {}}, _patch_operations(container))
+    assert doc["instagramPostId"] == "ig-1"
+    assert doc["postStatus"] == "published"
+    assert doc["checkpoints"] == {}
+
+    repository.record_publish_result("post-1", post_result, checkpoint=True)
+    doc = _apply_patch({"checkpoints": {}, "metadata": {}}, _patch_operations(container))
+    assert doc["checkpoints"] == {"publish": post_result}
+
+
+def test_record_publish_result_is_conditional_on_etag():
+    container = MagicMock()
+
+    PostRepository(container).record_publish_result("post-1", {"postStatus": "published"}, etag="etag-1")
+
+    assert container.patch_item.call_args.kwargs["etag"] == "etag-1"
+    assert container.patch_item.call_args.kwargs["match_condition"] == MatchConditions.IfNotModified
+
+
+def test_load_checkpoints():
+    container = MagicMock()
+    container.read_item.return_value = {"id": "post-1", "checkpoints": {"text": {"text": "Hi"}}}
+    assert PostRepository(container).load_checkpoints("post-1") == {"text": {"text": "Hi"}}
+
+    container.read_item.side_effect = CosmosResourceNotFoundError(message="not found")
+    assert PostRepository(container).load_checkpoints("post-1") == {}
@@ -0,0 +1,41 @@
+from shared.utils.prompt_template import compile_prompt
+
+
+def test_render_fills_placeholders():
+    prompt = compile_prompt("Write about {{topic}} for {{audience}}.")
+
+    assert prompt.render({"topic": "coffee", "audience": "students"}) == "Write about coffee for students."
+
+
+def test_render_repeated_placeholder_and_literal_braces():
+    prompt = compile_prompt('Return {"topic": "{{topic}}"} about {{topic}}.')
+
+    assert prompt.render({"topic": "tea"}) == 'Return {"topic": "tea"} about tea.'
+
+
+def test_render_leaves_missing_placeholders():
+    prompt = compile_prompt("Write about {{topic}} for {{audience}}.")
+
+    assert prompt.render({"topic": "coffee"}) == "Write about coffee for {{audience}}."
+    assert prompt.missing({"topic": "coffee"}) == ["audience"]
+    assert prompt.extra({"topic": "coffee", "tone": "casual"}) == ["tone"]
+
+
+def test_render_many_matches_render():
+    prompt = compile_prompt("{{greeting}}, {{name}}!")
+    value_sets = [{"greeting": "Hi", "name": "Ana"}, {"greeting": "Hello", "name": 3}]
+
+    assert prompt.render_many(value_sets) == [prompt.render(values) for values in value_sets]
+    assert prompt.render_many(value_sets) == ["Hi, Ana!", "Hello, 3!"]
+
+
+def test_prompt_without_placeholders():
+    prompt = compile_prompt("No variables {here}.")
+
+    assert prompt.variables == ()
+    assert prompt.render({"here": "x"}) == "No variables {here}."
+    assert compile_prompt(None).render({}) == ""
+
+
+def test_compile_prompt_is_cached_by_text():
+    assert compile_prompt("Hi {{name}}") is compile_prompt("Hi {{name}}")
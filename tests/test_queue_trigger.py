@@ -0,0 +1,149 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from azure.cosmos.exceptions import CosmosResourceExistsError, CosmosResourceNotFoundError
+
+import blueprints.orchestrator_blueprint as orchestrator_blueprint
+import blueprints.scheduling.queue_trigger as queue_trigger
+import shared.idempotency as idempotency
+from shared.errors import StageError
+
+
+class FakeIdempotencyContainer:
+    """In-memory stand-in for the idempotency container."""
+
+    def __init__(self):
+        self.items = {}
+
+    def create_item(self, body):
+        if body["id"] in self.items:
+            raise CosmosResourceExistsError(message="exists")
+        self.items[body["id"]] = {**body, "_etag": "1"}
+
+    def read_item(self, item, partition_key):
+        if item not in self.items:
+            raise CosmosResourceNotFoundError(message="not found")
+        return self.items[item]
+
+    def upsert_item(self, body):
+        self.items[body["id"]] = {**body, "_etag": "2"}
+
+    def delete_item(self, item, partition_key):
+        self.items.pop(item, None)
+
+
+class FakeQueueMessage:
+    def __init__(self, payload, message_id="msg-1", dequeue_count=1):
+        self.id = message_id
+        self.dequeue_count = dequeue_count
+        self._body = json.dumps(payload).encode("utf-8")
+
+    def get_body(self):
+        return self._body
+
+
+@pytest.fixture
+def scheduled_run(monkeypatch):
+    """
+    Patches storage and the pipeline; returns (orchestration calls, sent queue messages, idempotency container,
+    errors the next runs raise).
+    """
+    container = FakeIdempotencyContainer()
+    monkeypatch.setattr(idempotency, "get_container", lambda name: container)
+    monkeypatch.setenv("AzureWebJobsStorage", "UseDevelopmentStorage=true")
+    monkeypatch.delenv("SCHEDULER_PREGENERATE_LEAD_MINUTES", raising=False)
+
+    runs = []
+    failures = []
+
+    def fake_run_orchestration(template_id, brand_id, variable_values, user_id, post_id=None, **kwargs):
+        runs.append(post_id)
+        if failures:
+            raise failures.pop(0)
+        return {"id": post_id, "content": "Generated content", "imageUrl": "https://example.com/image.png"}
+
+    monkeypatch.setattr(orchestrator_blueprint, "run_orchestration", fake_run_orchestration)
+
+    sent = []
+
+    class FakeQueueClient:
+        @classmethod
+        def from_connection_string(cls, conn_str, queue_name):
+            return cls()
+
+        def send_message(self, content, visibility_timeout=None):
+            sent.append(json.loads(content))
+
+    monkeypatch.setattr(queue_trigger, "QueueClient", FakeQueueClient)
+    return runs, sent, container, failures
+
+
+def _slot_message(dequeue_count=1):
+    slot_time = (datetime.utcnow() - timedelta(minutes=1)).replace(microsecond=0).isoformat()
+    return FakeQueueMessage(dequeue_count=dequeue_count, payload={
+        "templateId": "template-123",
+        "brandId": "brand-123",
+        "schedule": {"daysOfWeek": ["monday"], "timeSlots": [{"hour": 9, "minute": 0, "timezone": "UTC"}]},
+        "slotTime": slot_time,
+    })
+
+
+def test_queue_trigger_runs_orchestrator_and_enqueues_next_slot(scheduled_run):
+    runs, sent, container, _ = scheduled_run
+
+    queue_trigger.main(_slot_message())
+
+    assert len(runs) == 1
+    assert runs[0] is not None  # Scheduled runs are idempotent and resumable
+    assert [doc["status"] for doc in container.items.values()] == [idempotency.STATUS_COMPLETED]
+    assert len(sent) == 1
+    assert sent[0]["templateId"] == "template-123"
+    assert sent[0]["slotTime"] > datetime.utcnow().isoformat()
+
+
+def test_queue_trigger_redelivery_replays_without_rescheduling(scheduled_run):
+    runs, sent, _, _ = scheduled_run
+    message = _slot_message()
+
+    queue_trigger.main(message)
+    queue_trigger.main(message)
+
+    assert len(runs) == 1
+    assert len(sent) == 1
+
+
+def test_queue_trigger_raises_transient_failure_for_redelivery(scheduled_run):
+    runs, sent, container, failures = scheduled_run
+    failures.append(StageError("Stage 'render' failed", 502))
+
+    with pytest.raises(RuntimeError):
+        queue_trigger.main(_slot_message())
+
+    assert sent == []  # The next slot is enqueued by the delivery that finishes this one
+    assert container.items == {}  # The claim is released so the redelivery resumes
+
+    queue_trigger.main(_slot_message(dequeue_count=2))
+
+    assert len(runs) == 2
+    assert runs[0] == runs[1]  # Same post id, so the retry resumes from its checkpoints
+    assert len(sent) == 1
+
+
+def test_queue_trigger_schedules_next_slot_on_last_delivery(scheduled_run, monkeypatch):
+    runs, sent, _, failures = scheduled_run
+    monkeypatch.setenv("SCHEDULER_QUEUE_MAX_DEQUEUE_COUNT", "3")
+    failures.append(StageError("Stage 'publish' failed", 502))
+
+    queue_trigger.main(_slot_message(dequeue_count=3))
+
+    assert len(sent) == 1
+
+
+def test_queue_trigger_schedules_next_slot_after_permanent_failure(scheduled_run):
+    runs, sent, _, failures = scheduled_run
+    failures.append(StageError("Template with id template-123 not found.", 404))
+
+    queue_trigger.main(_slot_message())
+
+    assert len(sent) == 1
@@ -0,0 +1,130 @@
+from unittest.mock import MagicMock
+
+import httpx
+import openai
+import pytest
+
+import shared.utils.rate_limiter as rate_limiter
+from shared.errors import StageError
+from shared.utils.openai_utils import _retry_delay, create_chat_completion
+from shared.utils.rate_limiter import RateLimiter, TokenBucket, get_rate_limiter
+
+
+def _rate_limit_error(headers=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+    response = httpx.Response(429, headers=headers or {}, request=request)
+    return openai.RateLimitError("Too Many Requests", response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def clear_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    for name in ("FUNCTIONS_WORKER_PROCESS_COUNT", "AZURE_OPENAI_RATE_LIMIT_INSTANCES",
+                 "AZURE_OPENAI_TPM_LIMIT", "AZURE_OPENAI_RPM_LIMIT"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_token_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(capacity=60, rate=1)
+    bucket._updated = 0.0
+
+    assert bucket.reserve(60, now=0.0) == 0.0
+    assert bucket.reserve(10, now=10.0) == 0.0  # 10 seconds refilled 10 units
+    assert bucket.reserve(1, now=10.0) == 1.0
+    bucket.adjust(0, now=1000.0)
+    assert bucket._tokens == 60  # Never refills past capacity
+
+
+def test_token_bucket_reservations_queue_in_arrival_order():
+    bucket = TokenBucket(capacity=60, rate=1)
+    bucket._updated = 0.0
+    bucket.reserve(60, now=0.0)
+
+    waits = [bucket.reserve(10, now=0.0) for _ in range(3)]
+
+    assert waits == [10.0, 20.0, 30.0]  # Each caller waits behind the debt of the ones before it
+
+
+def test_token_bucket_adjust_returns_unused_estimate():
+    bucket = TokenBucket(capacity=60, rate=1)
+    bucket._updated = 0.0
+    bucket.reserve(60, now=0.0)
+
+    bucket.adjust(30, now=0.0)
+
+    assert bucket.reserve(30, now=0.0) == 0.0
+
+
+def test_rate_limiter_waits_for_slowest_bucket_and_block():
+    limiter = RateLimiter(tokens_per_minute=600, requests_per_minute=60)
+
+    assert limiter._reserve(600) == 0.0
+    assert limiter._reserve(60) == pytest.approx(6.0, abs=0.1)  # 60 tokens at 10/s
+
+    limiter.block_for(30)
+    assert limiter._reserve(0) == pytest.approx(30.0, abs=0.1)
+
+
+def test_rate_limiter_without_limits_never_waits():
+    limiter = RateLimiter()
+
+    assert [limiter._reserve(10 ** 6) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_get_rate_limiter_divides_limits_across_processes_and_instances(monkeypatch):
+    monkeypatch.setenv("FUNCTIONS_WORKER_PROCESS_COUNT", "2")
+    monkeypatch.setenv("AZURE_OPENAI_RATE_LIMIT_INSTANCES", "3")
+    monkeypatch.setenv("AZURE_OPENAI_TPM_LIMIT", "60000")
+    monkeypatch.setenv("AZURE_OPENAI_RPM_LIMIT", "600")
+
+    limiter = get_rate_limiter("gpt-4")
+
+    assert limiter.tokens.capacity == 10000
+    assert limiter.requests.capacity == 100
+    assert get_rate_limiter("gpt-4") is limiter
+    assert get_rate_limiter("gpt-4o", tokens_per_minute=6000).tokens.capacity == 1000
+
+
+def test_retry_delay_prefers_retry_after_ms():
+    error = _rate_limit_error({"retry-after-ms": "1500", "retry-after": "7"})
+
+    assert _retry_delay(error, attempt=0) == 1.5
+
+
+def test_retry_delay_uses_retry_after_seconds():
+    assert _retry_delay(_rate_limit_error({"retry-after": "7"}), attempt=0) == 7.0
+
+
+def test_retry_delay_backs_off_without_header():
+    assert _retry_delay(_rate_limit_error({"retry-after": "soon"}), attempt=3) == 8.0
+    assert _retry_delay(_rate_limit_error(), attempt=1) == 2.0
+
+
+def test_retry_delay_does_not_retry_client_errors():
+    request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+    response = httpx.Response(400, request=request)
+
+    assert _retry_delay(openai.BadRequestError("Bad Request", response=response, body=None), attempt=0) is None
+
+
+def test_create_chat_completion_blocks_limiter_for_retry_after():
+    client = MagicMock()
+    client.chat.completions.create.side_effect = [_rate_limit_error({"retry-after-ms": "250"}), "response"]
+    limiter = MagicMock()
+
+    result = create_chat_completion({"model": "gpt-4", "messages": []}, client=client, limiter=limiter, max_retries=1)
+
+    assert result == "response"
+    limiter.block_for.assert_called_once_with(0.25)
+    assert limiter.acquire.call_count == 2
+
+
+def test_create_chat_completion_raises_429_after_retries():
+    client = MagicMock()
+    client.chat.completions.create.side_effect = _rate_limit_error({"retry-after": "1"})
+
+    with pytest.raises(StageError) as excinfo:
+        create_chat_completion({"model": "gpt-4", "messages": []}, client=client, limiter=MagicMock(), max_retries=2)
+
+    assert excinfo.value.status_code == 429
+    assert client.chat.completions.create.call_count == 3
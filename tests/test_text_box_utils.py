@@ -0,0 +1,49 @@
+from PIL import Image, ImageDraw, ImageFont
+
+from shared.utils.text_box_utils import calculate_text_box
+
+TEXT = "Autofit shrinks the font until the wrapped text fits inside the container box"
+
+
+def _fits(draw, text, size, width, height):
+    box = calculate_text_box(draw, text, ImageFont.load_default(size=size), width, height, autofit=False)
+    return "..." not in box["wrapped_text"] and box["text_h"] <= int(height * 0.8)
+
+
+def _draw():
+    return ImageDraw.Draw(Image.new("RGB", (400, 300)))
+
+
+def test_autofit_picks_largest_font_size_that_fits():
+    draw = _draw()
+
+    box = calculate_text_box(draw, TEXT, ImageFont.load_default(size=96), 400, 300, min_font_size=10)
+    size = box["font"].size
+
+    assert 10 < size < 96
+    assert "..." not in box["wrapped_text"]
+    assert box["box_height"] <= int(300 * 0.8)
+    assert not _fits(draw, TEXT, size + 1, 400, 300)
+
+
+def test_autofit_keeps_font_that_already_fits():
+    font = ImageFont.load_default(size=20)
+
+    box = calculate_text_box(_draw(), "Short text", font, 400, 300)
+
+    assert box["font"] is font
+
+
+def test_truncates_at_min_font_size():
+    box = calculate_text_box(_draw(), TEXT * 20, ImageFont.load_default(size=40), 400, 300, min_font_size=30)
+
+    assert box["font"].size == 30
+    assert box["wrapped_text"].endswith("...")
+    assert box["box_height"] <= int(300 * 0.8)
+
+
+def test_autofit_disabled_truncates_at_initial_size():
+    box = calculate_text_box(_draw(), TEXT * 5, ImageFont.load_default(size=60), 400, 300, autofit=False)
+
+    assert box["font"].size == 60
+    assert box["wrapped_text"].endswith("...")
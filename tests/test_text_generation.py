@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+
+import azure.functions as func
+import httpx
+import openai
+import pytest
+
+import blueprints.azure_openai_content_generation.azure_openai_content_generation_blueprint as text_generation
+from shared.errors import StageError
+
+VALID = {"text": "Fresh roast", "comment": "Try it today", "hashtags": ["#coffee"]}
+
+
+def _completion(content):
+    message = SimpleNamespace(content=content, refusal=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=SimpleNamespace(total_tokens=10))
+
+
+def _bad_request(message, param=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+    response = httpx.Response(400, request=request)
+    return openai.BadRequestError(message, response=response, body={"message": message, "param": param})
+
+
+class FakePool:
+    """Deployment pool that records requests and answers with scripted completions or errors."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def complete(self, chat_request):
+        self.requests.append(chat_request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _completion(outcome)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(text_generation, "get_openai_settings", lambda: {"deployment": "gpt-4"})
+    monkeypatch.setattr(text_generation, "_structured_output_unsupported", set())
+    monkeypatch.delenv("TEXT_GENERATION_MAX_REPAIRS", raising=False)
+
+    def install(*outcomes):
+        fake = FakePool(*outcomes)
+        monkeypatch.setattr(text_generation, "get_deployment_pool", lambda: fake)
+        return fake
+
+    return install
+
+
+def test_rejected_response_format_falls_back_and_is_remembered(pool, sample_template):
+    fake = pool(_bad_request("response_format json_schema is not supported", "response_format"),
+                json.dumps(VALID), json.dumps(VALID))
+
+    assert text_generation.generate_text_content_logic(sample_template, {}) == VALID
+    assert "response_format" in fake.requests[0]
+    assert "response_format" not in fake.requests[1]
+
+    # The deployment is remembered, so the next request is sent without response_format straight away
+    assert text_generation.generate_text_content_logic(sample_template, {}) == VALID
+    assert len(fake.requests) == 3
+    assert "response_format" not in fake.requests[2]
+
+
+def test_other_bad_requests_are_not_retried(pool, sample_template):
+    fake = pool(_bad_request("max_tokens is too large", "max_tokens"))
+
+    with pytest.raises(openai.BadRequestError):
+        text_generation.generate_text_content_logic(sample_template, {})
+    assert len(fake.requests) == 1
+    assert text_generation._structured_output_unsupported == set()
+
+
+def test_invalid_content_is_repaired(pool, sample_template):
+    fake = pool(json.dumps({"text": "Fresh roast"}), json.dumps(VALID))
+
+    assert text_generation.generate_text_content_logic(sample_template, {}) == VALID
+    repair_request = fake.requests[1]
+    assert repair_request["temperature"] == 0
+    assert '{"text": "Fresh roast"}' in repair_request["messages"][1]["content"]
+
+
+def test_repairs_are_bounded_by_max_repairs(pool, sample_template, monkeypatch):
+    monkeypatch.setenv("TEXT_GENERATION_MAX_REPAIRS", "1")
+    fake = pool("not json", "still not json", json.dumps(VALID))
+
+    with pytest.raises(StageError) as excinfo:
+        text_generation.generate_text_content_logic(sample_template, {})
+
+    assert excinfo.value.status_code == 502
+    assert len(fake.requests) == 2  # The generation and a single repair
+
+
+def test_no_repairs_when_max_repairs_is_zero(pool, sample_template, monkeypatch):
+    monkeypatch.setenv("TEXT_GENERATION_MAX_REPAIRS", "0")
+    fake = pool("not json")
+
+    with pytest.raises(StageError):
+        text_generation.generate_text_content_logic(sample_template, {})
+    assert len(fake.requests) == 1
+
+
+def _post(body):
+    request = func.HttpRequest(
+        method="POST", url="/api/generate-text-content", body=json.dumps(body).encode("utf-8")
+    )
+    handler = text_generation.generate_text_content._function.get_user_function()
+    return handler(request)
+
+
+def test_route_maps_validation_errors_to_400(pool):
+    response = _post({"variableValues": {"topic": "coffee"}})  # No template
+
+    assert response.status_code == 400
+    assert "template" in json.loads(response.get_body())["error"]
+
+
+def test_route_maps_invalid_variant_count_to_400(pool, sample_template):
+    response = _post({"template": sample_template, "variantCount": 11})
+
+    assert response.status_code == 400
+
+
+def test_route_returns_generated_content(pool, sample_template):
+    pool(json.dumps(VALID))
+
+    response = _post({"template": sample_template, "variableValues": {"topic": "coffee"}})
+
+    assert response.status_code == 200
+    assert json.loads(response.get_body()) == VALID